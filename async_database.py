@@ -0,0 +1,196 @@
+"""
+Async counterparts of the public database API.
+
+Each coroutine runs the matching blocking function from database.py on a
+dedicated thread pool, so event-loop code never stalls on SQLite I/O or
+password hashing. Return values and exceptions are the same as the sync API.
+
+Concurrency is bounded per event loop: at most ASYNC_WORKERS calls run at
+once, up to ASYNC_QUEUE_LIMIT more wait for a slot, and anything beyond that
+fails fast with ServerBusyError. Cancelling a call that is still waiting
+means it never runs. A call that has already started can't be interrupted,
+so it finishes in the background and keeps its slot until then. A cancelled
+write may therefore still have been applied.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import metrics
+from database import ServerBusyError, SERVER_BUSY_MESSAGE
+
+# Threads running blocking calls; matching the connection pool means calls rarely wait for a connection
+ASYNC_WORKERS = int(os.environ.get('COPLUR_ASYNC_WORKERS', str(database.POOL_SIZE)))
+# Calls per event loop allowed to wait for a free worker before new ones are rejected
+ASYNC_QUEUE_LIMIT = int(os.environ.get('COPLUR_ASYNC_QUEUE_LIMIT', '64'))
+
+class _LoopLimiter:
+    """Concurrency limit and wait-queue length for one event loop"""
+
+    def __init__(self, limit):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+
+_limiters = weakref.WeakKeyDictionary()
+_executor = None
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats = {'submitted': 0, 'rejected': 0, 'cancelled': 0, 'abandoned': 0, 'in_flight': 0}
+
+def _count(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _get_limiter():
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = _LoopLimiter(max(1, ASYNC_WORKERS))
+    return loop, limiter
+
+def _get_executor():
+    """Start the worker threads on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, ASYNC_WORKERS), thread_name_prefix='coplur-async-db'
+            )
+        return _executor
+
+def _release_later(loop, semaphore, future):
+    """Free a slot once an abandoned call finishes in its worker thread"""
+    def on_done(_future):
+        _count('in_flight', -1)
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            pass  # Loop already closed; its limiter goes with it
+    future.add_done_callback(on_done)
+
+async def _run(func, *args, **kwargs):
+    """Run a blocking database function on the executor under the loop's concurrency limit"""
+    loop, limiter = _get_limiter()
+
+    if limiter.semaphore.locked() and limiter.waiting >= ASYNC_QUEUE_LIMIT:
+        _count('rejected')
+        raise ServerBusyError(SERVER_BUSY_MESSAGE)
+
+    limiter.waiting += 1
+    try:
+        await limiter.semaphore.acquire()
+    finally:
+        limiter.waiting -= 1
+
+    # Carry the caller's context into the worker thread, as asyncio.to_thread does
+    call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+    try:
+        future = _get_executor().submit(call)
+    except BaseException:
+        limiter.semaphore.release()
+        raise
+    _count('submitted')
+    _count('in_flight')
+
+    try:
+        # Shielded so cancellation is handled below rather than propagated into the pool
+        result = await asyncio.shield(asyncio.wrap_future(future))
+    except asyncio.CancelledError:
+        if future.cancel():
+            _count('cancelled')
+            _count('in_flight', -1)
+            limiter.semaphore.release()
+        else:
+            _count('abandoned')
+            _release_later(loop, limiter.semaphore, future)
+        raise
+    except BaseException:
+        _count('in_flight', -1)
+        limiter.semaphore.release()
+        raise
+
+    _count('in_flight', -1)
+    limiter.semaphore.release()
+    return result
+
+def get_async_stats():
+    """Snapshot of async executor counters"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats.update({'workers': ASYNC_WORKERS, 'queue_limit': ASYNC_QUEUE_LIMIT})
+    return stats
+
+metrics.registry.gauge(
+    'coplur_async_db',
+    lambda: {(('stat', key),): value for key, value in get_async_stats().items()},
+    "Async database executor state and admission counters"
+)
+
+def shutdown(wait=True):
+    """Stop the worker threads; the next call starts a fresh pool"""
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=wait)
+
+async def authenticate_user(username, password):
+    """
+    Authenticate user login
+    Returns: user dict if successful, None if failed
+    Raises: ServerBusyError if the executor or hashing service is at capacity
+    """
+    return await _run(database.authenticate_user, username, password)
+
+async def create_user(username, email, password, role='student'):
+    """Create a new user; returns (success, message)"""
+    return await _run(database.create_user, username, email, password, role)
+
+async def bulk_create_users(rows):
+    """Create many users at once; returns (created count, list of row errors)"""
+    return await _run(database.bulk_create_users, rows)
+
+async def get_user_by_id(user_id):
+    """Get user by ID; returns user dict or None"""
+    return await _run(database.get_user_by_id, user_id)
+
+async def get_all_users():
+    """Get all users for admin dashboard"""
+    return await _run(database.get_all_users)
+
+async def list_users(cursor=None, limit=database.DEFAULT_PAGE_SIZE, sort='newest', role_filter=None):
+    """Get one page of users; returns {'users': [...], 'next_cursor': str or None}"""
+    return await _run(database.list_users, cursor, limit, sort, role_filter)
+
+async def get_role_counts():
+    """Get user counts per role; returns {'admin', 'student', 'total'}"""
+    return await _run(database.get_role_counts)
+
+async def update_user(user_id, username, email, role):
+    """Update user details; returns (success, message)"""
+    return await _run(database.update_user, user_id, username, email, role)
+
+async def update_password(username, new_password):
+    """Set a user's password; returns (success, message)"""
+    return await _run(database.update_password, username, new_password)
+
+async def change_password(user_id, current_password, new_password):
+    """Verify the current password and replace it; returns (success, message)"""
+    return await _run(database.change_password, user_id, current_password, new_password)
+
+async def delete_user(user_id):
+    """Delete a user; returns (success, message)"""
+    return await _run(database.delete_user, user_id)
+
+async def bulk_delete_users(user_ids):
+    """Delete many users at once; returns (success, message)"""
+    return await _run(database.bulk_delete_users, user_ids)
+
+async def bulk_update_roles(user_ids, role):
+    """Set the role of many users at once; returns (success, message)"""
+    return await _run(database.bulk_update_roles, user_ids, role)
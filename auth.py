@@ -1,6 +1,22 @@
 import streamlit as st
-from database import authenticate_user, create_user, update_password
+from database import (
+    authenticate_user, create_user, change_password, check_availability, get_user_by_id,
+    revoke_sessions, record_auth_event, set_audit_context, ServerBusyError, SERVER_BUSY_MESSAGE
+)
+from security import (
+    has_required_role, issue_token, verify_token, user_from_claims, session_is_current,
+    check_login_rate, login_throttled_message
+)
+import os
 import re
+import time
+
+# Signed session token, kept in the URL so a reload or reconnect can restore the login
+SESSION_QUERY_PARAM = 'session'
+SESSION_COOKIE = 'coplur_session'  # Also accepted, e.g. when set by a reverse proxy
+# Re-issue the token once it is this many seconds old, so active users never expire;
+# each refresh also re-checks the account, so revocations apply within this interval
+SESSION_REFRESH_AFTER = int(os.environ.get('COPLUR_SESSION_REFRESH_AFTER', '300'))
 
 def init_session_state():
     """Initialize session state variables with persistence"""
@@ -8,8 +24,8 @@ def init_session_state():
         st.session_state.authenticated = False
     if 'user' not in st.session_state:
         st.session_state.user = None
-    if 'login_attempts' not in st.session_state:
-        st.session_state.login_attempts = 0
+    if 'session_token' not in st.session_state:
+        st.session_state.session_token = None
     # Add session persistence flag
     if 'session_initialized' not in st.session_state:
         st.session_state.session_initialized = True
@@ -82,29 +98,69 @@ def check_persistent_messages():
                 st.session_state[f'{msg_type}_message'] = None
                 st.session_state[f'{msg_type}_timestamp'] = None
 
+def get_client_address():
+    """Get the browser's IP address, or None when Streamlit doesn't expose it (e.g. localhost)"""
+    address = getattr(getattr(st, 'context', None), 'ip_address', None)
+    return address if isinstance(address, str) else None
+
 def login_user(username, password):
     """Simple login function"""
     if not username or not password:
         return False, "Please enter both username and password"
     
-    if st.session_state.login_attempts >= 5:
-        return False, "Too many login attempts. Please refresh."
+    set_audit_context(None, get_client_address())
+    
+    # Process-wide limits, checked before any SQLite or bcrypt work; a new browser session doesn't reset them
+    allowed, retry_after = check_login_rate(username, get_client_address())
+    if not allowed:
+        record_auth_event('login_throttled', username)
+        return False, login_throttled_message(retry_after)
+    
+    try:
+        user = authenticate_user(username, password)
+    except ServerBusyError:
+        # Overload isn't the user's fault, so don't report it as invalid credentials
+        return False, SERVER_BUSY_MESSAGE
     
-    user = authenticate_user(username, password)
     if user:
-        st.session_state.authenticated = True
-        st.session_state.user = user
-        st.session_state.login_attempts = 0
+        start_session(user)
         return True, f"Welcome back, {user['username']}!"
     else:
-        st.session_state.login_attempts += 1
         return False, "Invalid credentials"
 
+def _read_session_token():
+    """Get the session token from the URL, falling back to a cookie"""
+    token = st.query_params.get(SESSION_QUERY_PARAM)
+    if not token:
+        cookies = getattr(getattr(st, 'context', None), 'cookies', None)
+        token = cookies.get(SESSION_COOKIE) if cookies else None
+    return token
+
+def _store_session_token(token):
+    st.session_state.session_token = token
+    st.query_params[SESSION_QUERY_PARAM] = token
+
+def start_session(user):
+    """Mark the user as logged in and issue a signed session token"""
+    st.session_state.authenticated = True
+    st.session_state.user = user
+    token, _ = issue_token(user)
+    _store_session_token(token)
+
 def logout_user():
-    """Clear user session and logout"""
+    """Log out and revoke the user's session tokens, including copies left in browser history or shared links"""
+    user = get_current_user()
+    if isinstance(user, dict) and user.get('id'):
+        revoke_sessions(user['id'])  # Also ends the user's sessions in other browsers
+    clear_session()
+
+def clear_session():
+    """Clear the login from this browser session without revoking its token"""
     st.session_state.authenticated = False
     st.session_state.user = None
-    st.session_state.login_attempts = 0
+    st.session_state.session_token = None
+    if SESSION_QUERY_PARAM in st.query_params:
+        del st.query_params[SESSION_QUERY_PARAM]
     # Clear other session data if needed
     for key in list(st.session_state.keys()):
         if key.startswith('temp_'):
@@ -121,6 +177,7 @@ def register_student(username, email, password, confirm_password):
         return validation_result
     
     # Create student account
+    set_audit_context(None, get_client_address())
     success, message = create_user(username, email, password, 'student')
     return success, message
 
@@ -156,33 +213,37 @@ def change_user_password(current_password, new_password, confirm_password):
     if not user:
         return False, "User not authenticated"
     
-    # Validate current password
-    auth_user = authenticate_user(user['username'], current_password)
-    if not auth_user:
+    if not current_password:
         return False, "Current password is incorrect"
     
-    # Validate new password
+    # Validate new password before any bcrypt work
     password_valid, password_msg = validate_password(new_password, confirm_password)
     if not password_valid:
         return False, password_msg
     
-    # Update password
-    success, message = update_password(user['username'], new_password)
+    # Verify and replace in one step, keyed by ID so a concurrent rename can't interfere
+    set_audit_context(user['username'], get_client_address())
+    success, message = change_password(user['id'], current_password, new_password)
     return success, message
 
 def require_role(required_role=None):
     """Require specific role for page access"""
-    if not is_authenticated():
+    # Pages can be opened directly, so restore a token-backed session first
+    validate_session()
+    
+    if not is_authenticated() or not has_required_role(get_current_user()):
         st.error("🔒 Please log in to access this page")
         st.stop()
     
-    if required_role == 'admin' and not is_admin():
-        st.error("⛔ Admin access required")
-        st.info("Contact your administrator for access to this page")
-        st.stop()
-    elif required_role == 'student' and not is_student():
-        st.error("⛔ Student access required")
+    # Same rule the JSON auth service applies to its endpoints
+    if not has_required_role(get_current_user(), required_role):
+        st.error(f"⛔ {required_role.title()} access required")
+        if required_role == 'admin':
+            st.info("Contact your administrator for access to this page")
         st.stop()
+    
+    # Changes made from this page are logged as made by this user
+    set_audit_context(get_current_user()['username'], get_client_address())
 
 def require_authentication():
     """Require authentication for page access"""
@@ -218,13 +279,27 @@ def create_login_form():
             else:
                 st.error("Please enter both username and password")
 
+def show_availability(label, available):
+    """Show live availability feedback under a registration field"""
+    if available is True:
+        st.caption(f"✅ {label} is available")
+    elif available is False:
+        st.caption(f"❌ {label} is already taken")
+
 def create_registration_form():
     """Simple student registration form"""
     st.subheader("📝 Student Registration")
     
+    # Outside the form so every edit reruns and gets checked against the in-memory membership index
+    username = st.text_input("Username", key="registration_username")
+    if username:
+        show_availability("Username", check_availability(username=username).get('username'))
+    
+    email = st.text_input("Email", key="registration_email")
+    if email and '@' in email:
+        show_availability("Email", check_availability(email=email).get('email'))
+    
     with st.form("registration_form"):
-        username = st.text_input("Username")
-        email = st.text_input("Email")
         password = st.text_input("Password", type="password")
         confirm_password = st.text_input("Confirm Password", type="password")
         
@@ -254,7 +329,7 @@ def create_password_change_form():
             if success:
                 show_persistent_message('success', message)
                 show_persistent_message('info', "Please log in again with your new password")
-                logout_user()
+                clear_session()  # The password change already revoked this user's tokens
                 st.rerun()
             else:
                 show_persistent_message('error', message)
@@ -289,12 +364,55 @@ def display_user_info():
         st.sidebar.info("👤 Not logged in")
 
 def validate_session():
-    """Validate current session"""
+    """
+    Validate or restore the current session from its signed token
+    Most reruns only check the HMAC and expiry. Restoring a session from the
+    URL and each sliding refresh also check the cached user record, so a
+    deleted, demoted, password-changed or logged-out account loses its
+    sessions. Never runs bcrypt.
+    """
     if is_authenticated():
         user = get_current_user()
         if not user or not isinstance(user, dict):
-            logout_user()
+            clear_session()
             return False
+        token = st.session_state.get('session_token')
+        if not token:
+            # Logged in before tokens were issued; give the session one
+            start_session(user)
+            return True
+    else:
+        token = _read_session_token()
+        if not token:
+            return True
+    
+    claims = verify_token(token)
+    refresh = claims is not None and time.time() - claims['iat'] >= SESSION_REFRESH_AFTER
+    if claims and (refresh or not is_authenticated()):
+        current = get_user_by_id(claims['uid'])
+        if not session_is_current(claims, current):
+            claims = None
+    if not claims:
+        # Expired after TOKEN_TTL seconds without a refresh, revoked, or tampered with
+        if is_authenticated():
+            st.info("Your session has expired. Please log in again.")
+        clear_session()
+        return False
+    
+    if not is_authenticated():
+        st.session_state.authenticated = True
+        st.session_state.user = user_from_claims(claims)
+    
+    # Sliding window: refresh an ageing token, and re-attach it if page navigation dropped it
+    if refresh:
+        # Also picks up a username or email changed by an admin since the last refresh
+        st.session_state.user = dict(
+            user_from_claims(claims), username=current['username'], email=current['email']
+        )
+        token, _ = issue_token(get_current_user())
+        _store_session_token(token)
+    elif st.query_params.get(SESSION_QUERY_PARAM) != token:
+        _store_session_token(token)
     return True
 
 # Initialize session state when module is imported
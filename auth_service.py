@@ -0,0 +1,322 @@
+"""
+Headless JSON auth service for other internal tools.
+
+Exposes login, token verification, user lookup and admin user management
+over HTTP/1.1 keep-alive connections, on top of database.py and the role
+rules in security.py. Each connection gets a thread, but only a core-sized
+number of requests run at once; password hashing still runs in
+database.py's process pool.
+
+Endpoints:
+    POST   /login            {"username", "password"} -> {"token", "expires_at", "user"} (rate limited)
+    GET    /verify           token claims, checked against the cached user record
+    GET    /users            one page of users (admin): ?cursor=&limit=&sort=&role=
+    POST   /users            create a user (admin): {"username", "email", "password", "role"}
+    GET    /users/<id>       user details (admin, or the user themself)
+    PATCH  /users/<id>       update username, email and/or role (admin)
+    DELETE /users/<id>       delete a user (admin)
+    GET    /health           liveness check
+
+Authenticated requests send "Authorization: Bearer <token>".
+
+Usage:
+    python auth_service.py --host 127.0.0.1 --port 8600
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import database
+import security
+from database import ServerBusyError, SERVER_BUSY_MESSAGE
+
+logger = logging.getLogger(__name__)
+
+# Service configuration; request workers mostly wait on SQLite and the hashing pool
+SERVICE_HOST = os.environ.get('COPLUR_SERVICE_HOST', '127.0.0.1')
+SERVICE_PORT = int(os.environ.get('COPLUR_SERVICE_PORT', '8600'))
+SERVICE_WORKERS = int(os.environ.get('COPLUR_SERVICE_WORKERS', str(2 * (os.cpu_count() or 1) + 1)))
+MAX_CONNECTIONS = int(os.environ.get('COPLUR_SERVICE_MAX_CONNECTIONS', '256'))
+KEEPALIVE_TIMEOUT = float(os.environ.get('COPLUR_SERVICE_KEEPALIVE_TIMEOUT', '15'))
+MAX_BODY_BYTES = 64 * 1024
+
+class ServiceError(Exception):
+    """Raised by endpoint handlers to return an error response"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+def _require_user(request, required_role=None):
+    """
+    Resolve the bearer token to a user and apply the auth.require_role rules
+    The token is checked against the cached user record, so deleted, demoted,
+    password-changed and logged-out accounts lose access immediately.
+    """
+    header = request.headers.get('Authorization', '')
+    claims = security.verify_token(header[7:]) if header.startswith('Bearer ') else None
+    if not claims or not security.session_is_current(claims, database.get_user_by_id(claims['uid'])):
+        raise ServiceError(401, "Please log in to access this endpoint")
+
+    user = security.user_from_claims(claims)
+    if not security.has_required_role(user, required_role):
+        raise ServiceError(403, f"{required_role.title()} access required")
+    database.set_audit_context(user['username'], request.client_address[0])
+    return user
+
+def _field(body, name, default=''):
+    """Read a string field from a request body"""
+    value = body.get(name, default)
+    if not isinstance(value, str):
+        raise ServiceError(400, f"{name} must be a string")
+    return value
+
+def _result(success, message, created=False):
+    """Map a (success, message) tuple from database.py to a response"""
+    if success:
+        return (201 if created else 200), {'success': True, 'message': message}
+    if message == SERVER_BUSY_MESSAGE:
+        raise ServiceError(503, message, retry_after=1)
+    status = 404 if message == "User not found" else 400
+    return status, {'success': False, 'message': message}
+
+def _login(request, body):
+    username = _field(body, 'username')
+    password = _field(body, 'password')
+    if not username or not password:
+        raise ServiceError(400, "Please enter both username and password")
+
+    # Shares the process-wide buckets with the Streamlit login form
+    allowed, retry_after = security.check_login_rate(username, request.client_address[0])
+    if not allowed:
+        database.record_auth_event('login_throttled', username)
+        raise ServiceError(429, security.login_throttled_message(retry_after), retry_after)
+
+    user = database.authenticate_user(username, password)
+    if not user:
+        raise ServiceError(401, "Invalid credentials")
+    token, expires_at = security.issue_token(user)
+    return 200, {'token': token, 'expires_at': expires_at, 'user': user}
+
+def _verify(request, body):
+    user = _require_user(request)
+    return 200, {'valid': True, 'user': user}
+
+def _list_users(request, body):
+    _require_user(request, 'admin')
+    query = {key: values[0] for key, values in parse_qs(request.query).items()}
+    try:
+        limit = int(query.get('limit', database.DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ServiceError(400, "limit must be an integer")
+    return 200, database.list_users(
+        query.get('cursor'), limit, query.get('sort', 'newest'), query.get('role')
+    )
+
+def _create_user(request, body):
+    _require_user(request, 'admin')
+    success, message = database.create_user(
+        _field(body, 'username'), _field(body, 'email'), _field(body, 'password'),
+        _field(body, 'role', 'student')
+    )
+    return _result(success, message, created=True)
+
+def _get_user(request, body, user_id):
+    user = _require_user(request)
+    if user['id'] != user_id:
+        _require_user(request, 'admin')
+    found = database.get_user_by_id(user_id)
+    if not found:
+        raise ServiceError(404, "User not found")
+    return 200, found
+
+def _update_user(request, body, user_id):
+    _require_user(request, 'admin')
+    current = database.get_user_by_id(user_id)
+    if not current:
+        raise ServiceError(404, "User not found")
+    return _result(*database.update_user(
+        user_id,
+        _field(body, 'username', current['username']),
+        _field(body, 'email', current['email']),
+        _field(body, 'role', current['role']),
+    ))
+
+def _delete_user(request, body, user_id):
+    _require_user(request, 'admin')
+    return _result(*database.delete_user(user_id))
+
+def _health(request, body):
+    return 200, {'status': 'ok', 'schema_version': database.SCHEMA_VERSION}
+
+# (method, path pattern, handler); a captured group is passed on as an int user ID
+ROUTES = [
+    ('POST', re.compile(r'/login'), _login),
+    ('GET', re.compile(r'/verify'), _verify),
+    ('GET', re.compile(r'/users'), _list_users),
+    ('POST', re.compile(r'/users'), _create_user),
+    ('GET', re.compile(r'/users/(\d+)'), _get_user),
+    ('PATCH', re.compile(r'/users/(\d+)'), _update_user),
+    ('DELETE', re.compile(r'/users/(\d+)'), _delete_user),
+    ('GET', re.compile(r'/health'), _health),
+]
+
+class AuthServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive by default
+    server_version = 'CoplurAuth/1.0'
+    timeout = KEEPALIVE_TIMEOUT  # Idle keep-alive connections are closed after this
+    disable_nagle_algorithm = True  # Headers and body go out as separate writes
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PATCH(self):
+        self._dispatch('PATCH')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # Without a usable length the rest of the connection can't be framed
+            self.close_connection = True
+            raise ServiceError(400, "Content-Length must be a non-negative integer")
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            raise ServiceError(413, "Request body too large")
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except (ValueError, UnicodeError):
+            raise ServiceError(400, "Request body must be JSON")
+        if not isinstance(body, dict):
+            raise ServiceError(400, "Request body must be a JSON object")
+        return body
+
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        self.query = parts.query
+        retry_after = None
+        # Keep-alive connections reuse this thread; _require_user sets the actor again
+        database.set_audit_context(None, self.client_address[0])
+        try:
+            # Always consume the body so the next request on this connection starts cleanly
+            body = self._read_body()
+            allowed = False
+            for route_method, pattern, handler in ROUTES:
+                match = pattern.fullmatch(parts.path)
+                if not match:
+                    continue
+                allowed = True
+                if route_method != method:
+                    continue
+                with self.server.request_slots:
+                    status, payload = handler(self, body, *(int(group) for group in match.groups()))
+                break
+            else:
+                if allowed:
+                    raise ServiceError(405, "Method not allowed")
+                raise ServiceError(404, "Not found")
+        except ServiceError as e:
+            status, payload = e.status, {'success': False, 'message': e.message}
+            retry_after = e.retry_after
+        except ServerBusyError:
+            status, payload = 503, {'success': False, 'message': SERVER_BUSY_MESSAGE}
+            retry_after = 1
+        except Exception:
+            logger.exception("Unhandled error for %s %s", method, self.path)
+            status, payload = 500, {'success': False, 'message': "Internal server error"}
+        self._send_json(status, payload, retry_after)
+
+    def _send_json(self, status, payload, retry_after=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if retry_after:
+            self.send_header('Retry-After', str(max(1, int(retry_after + 0.999))))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+class AuthHTTPServer(ThreadingHTTPServer):
+    """
+    Thread-per-connection server with a fixed number of request workers
+    Idle keep-alive connections only cost a parked thread; request handling
+    itself is limited to `workers` at a time, and connections beyond
+    MAX_CONNECTIONS are refused with a 503.
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers=SERVICE_WORKERS):
+        super().__init__(server_address, handler_class)
+        self.workers = workers
+        self.request_slots = threading.BoundedSemaphore(workers)
+        self._connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+    def process_request(self, request, client_address):
+        if not self._connection_slots.acquire(blocking=False):
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                b'Content-Length: 0\r\nConnection: close\r\nRetry-After: 1\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self._connection_slots.release()
+
+def create_server(host=SERVICE_HOST, port=SERVICE_PORT, workers=SERVICE_WORKERS):
+    """Bind the service; call serve_forever() on the result to start it"""
+    return AuthHTTPServer((host, port), AuthServiceHandler, workers)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Coplur JSON auth service")
+    parser.add_argument('--host', default=SERVICE_HOST)
+    parser.add_argument('--port', type=int, default=SERVICE_PORT)
+    parser.add_argument('--workers', type=int, default=SERVICE_WORKERS,
+                        help="requests handled at once (default: 2 x cores + 1)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    server = create_server(args.host, args.port, args.workers)
+    logger.info("Auth service listening on http://%s:%s with %d workers",
+                args.host, server.server_address[1], args.workers)
+    # Exit normally on SIGTERM so the hashing worker processes are shut down with us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        database.close_pool()
+
+if __name__ == "__main__":
+    main()
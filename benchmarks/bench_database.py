@@ -0,0 +1,284 @@
+"""
+Headless micro-benchmarks for the database layer.
+
+Seeds synthetic user populations of several sizes into temporary database
+files and measures latency percentiles and throughput of the public
+database functions, single-threaded and with concurrent threads. Results are
+written as JSON so runs from different commits can be compared.
+
+Usage:
+    python benchmarks/bench_database.py --sizes 10000 100000 --output bench.json
+    python benchmarks/bench_database.py --sizes 10000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+BENCH_PASSWORD = 'Bench123!'
+SEED_BATCH_SIZE = 10000
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the Coplur database layer")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help="user population sizes to seed")
+    parser.add_argument('--iterations', type=int, default=500,
+                        help="calls per function for fast lookups and writes")
+    parser.add_argument('--hash-iterations', type=int, default=20,
+                        help="calls per function for bcrypt-bound functions")
+    parser.add_argument('--scan-iterations', type=int, default=3,
+                        help="calls for full-table functions such as get_all_users")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="thread count for the concurrent runs (0 to skip them)")
+    parser.add_argument('--functions', nargs='+',
+                        help="only run these functions (default: all)")
+    parser.add_argument('--cache', action='store_true',
+                        help="keep the user cache enabled (default: disabled to measure SQLite)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="print p50/p95 changes against an earlier results file")
+    return parser.parse_args()
+
+def git_commit():
+    """Current commit hash, if the benchmark runs from a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def seed_users(database_file, size, password_hash):
+    """Insert size synthetic users with one precomputed hash"""
+    conn = sqlite3.connect(database_file)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        conn.execute("BEGIN")
+        for start in range(0, size, SEED_BATCH_SIZE):
+            batch = []
+            for i in range(start, min(start + SEED_BATCH_SIZE, size)):
+                created_at = now - timedelta(seconds=(size - i) * 30)
+                batch.append((
+                    f'bench{i}',
+                    f'bench{i}@example.com',
+                    password_hash,
+                    'admin' if i % 50 == 0 else 'student',
+                    created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                ))
+            conn.executemany("""
+                INSERT INTO users (username, email, password_hash, role, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def is_error(result):
+    """Treat falsy results and (False, message) tuples as failed calls"""
+    if isinstance(result, tuple):
+        return not result[0]
+    return not result
+
+def run_benchmark(call, arguments, threads):
+    """Time call(*args) for every entry in arguments, optionally across threads"""
+    latencies = []
+    errors = 0
+
+    def timed(args):
+        started = time.perf_counter()
+        try:
+            failed = is_error(call(*args))
+        except Exception:
+            failed = True
+        return time.perf_counter() - started, failed
+
+    started = time.perf_counter()
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            outcomes = list(executor.map(timed, arguments))
+    else:
+        outcomes = [timed(args) for args in arguments]
+    elapsed = time.perf_counter() - started
+
+    for latency, failed in outcomes:
+        latencies.append(latency * 1000)
+        errors += failed
+
+    latencies.sort()
+    return {
+        'calls': len(latencies),
+        'errors': errors,
+        'mean_ms': statistics.fmean(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p90_ms': percentile(latencies, 0.90),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+        'throughput_per_s': len(latencies) / elapsed if elapsed else 0.0,
+    }
+
+def split_user_ids(size, rng):
+    """
+    Split seeded student IDs into disjoint pools so deletes and renames never
+    affect the users that lookups and logins sample from
+    """
+    # Two default users come first, so bench{i} has id i + 3
+    student_ids = [i + 3 for i in range(size) if i % 50 != 0]
+    rng.shuffle(student_ids)
+    third = len(student_ids) // 3
+    return {
+        'delete': iter(student_ids[:third]),
+        'update': iter(student_ids[third:2 * third]),
+        'stable': student_ids[2 * third:],
+    }
+
+def build_workloads(database, pools, args, rng, run_id):
+    """
+    Build (name, function, argument factory, iterations) for every benchmarked function
+    Writes use fresh names per run so repeated runs against one population don't collide.
+    """
+    stable = pools['stable']
+
+    return [
+        ('authenticate_user', database.authenticate_user,
+         lambda n: [(f'bench{rng.choice(stable) - 3}', BENCH_PASSWORD) for _ in range(n)],
+         args.hash_iterations),
+        ('create_user', database.create_user,
+         lambda n: [(f'new{run_id}_{i}', f'new{run_id}_{i}@example.com', BENCH_PASSWORD)
+                    for i in range(n)], args.hash_iterations),
+        ('get_all_users', database.get_all_users,
+         lambda n: [() for _ in range(n)], args.scan_iterations),
+        ('get_user_by_id', database.get_user_by_id,
+         lambda n: [(rng.choice(stable),) for _ in range(n)], args.iterations),
+        ('update_user', database.update_user,
+         lambda n: [(user_id, f'upd_{user_id}', f'upd_{user_id}@example.com', 'student')
+                    for user_id in [next(pools['update']) for _ in range(n)]], args.iterations),
+        ('delete_user', database.delete_user,
+         lambda n: [(next(pools['delete']),) for _ in range(n)], args.iterations),
+    ]
+
+def benchmark_size(database, size, args, password_hash, rng):
+    """Seed one population and benchmark every function against it"""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='coplur_bench_') as tmp_dir:
+        database_file = os.path.join(tmp_dir, 'bench.db')
+        database.DATABASE_FILE = database_file
+        database.init_database()
+
+        started = time.perf_counter()
+        seed_users(database_file, size, password_hash)
+        print(f"[{size:>9,} users] seeded in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        pools = split_user_ids(size, rng)
+        modes = [('single', 1)]
+        if args.threads > 1:
+            modes.append(('concurrent', args.threads))
+
+        for mode, threads in modes:
+            workloads = build_workloads(database, pools, args, rng, run_id=mode)
+            for name, call, make_arguments, iterations in workloads:
+                if args.functions and name not in args.functions:
+                    continue
+                result = run_benchmark(call, make_arguments(iterations), threads)
+                result.update({'size': size, 'function': name, 'mode': mode, 'threads': threads})
+                results.append(result)
+                print(f"[{size:>9,} users] {name:<18} {mode:<10} "
+                      f"p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms "
+                      f"{result['throughput_per_s']:9.1f}/s errors={result['errors']}",
+                      file=sys.stderr)
+
+        database.close_pool()
+    return results
+
+def compare(results, baseline_file):
+    """Print p50/p95 changes relative to an earlier results file"""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {
+            (r['size'], r['function'], r['mode']): r for r in json.load(f)['results']
+        }
+
+    print(f"\nCompared with {baseline_file}:")
+    for result in results:
+        previous = baseline.get((result['size'], result['function'], result['mode']))
+        if not previous:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms'):
+            if previous[metric]:
+                change = (result[metric] - previous[metric]) / previous[metric] * 100
+                changes.append(f"{metric[:3]} {change:+6.1f}%")
+        print(f"  {result['size']:>9,} {result['function']:<18} {result['mode']:<10} {'  '.join(changes)}")
+
+def main():
+    args = parse_args()
+
+    # Point the module at a scratch file before import, since importing initialises it
+    scratch_dir = tempfile.mkdtemp(prefix='coplur_bench_')
+    os.environ['COPLUR_DATABASE_FILE'] = os.path.join(scratch_dir, 'import.db')
+    if not args.cache:
+        os.environ['COPLUR_USER_CACHE_SIZE'] = '0'
+    import database
+    import passwords
+
+    rng = random.Random(args.seed)
+    # Same cost as database.py uses, so logins verify without a rehash
+    password_hash = passwords.bcrypt_hash(BENCH_PASSWORD, database.BCRYPT_ROUNDS)
+
+    results = []
+    try:
+        for size in args.sizes:
+            results.extend(benchmark_size(database, size, args, password_hash, rng))
+    finally:
+        database.close_pool()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'hash_workers': database.HASH_WORKERS,
+            'cache_enabled': args.cache,
+            'arguments': vars(args),
+        },
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Load test for the Streamlit pages, measured per script rerun.
+
+Runs concurrent headless sessions with Streamlit's AppTest against a scratch
+database seeded with a large user base, all in this one process, just as
+the sessions of a single Streamlit server share it. Student sessions log
+in, open the student dashboard and change their password (which logs them
+out); admin sessions log in once, then open the admin dashboard, page
+through and search the user table. Every rerun is timed and the SQL
+statements it ran on pooled connections are counted; peak RSS of this
+process (not of the password hashing workers) is reported at the end.
+
+Usage:
+    python benchmarks/load_test_pages.py --users 100000 --sessions 16 --admin-sessions 2 --iterations 5
+    COPLUR_BCRYPT_ROUNDS=4 python benchmarks/load_test_pages.py --users 10000 --output pages.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; RSS is then not reported
+    resource = None
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+LOAD_PASSWORDS = ('Load123!pass', 'Load456!pass')  # Student sessions alternate between these
+SEED_BATCH_SIZE = 10000
+SESSION_KEY = 'load_test_session'  # Session state marker that attributes SQL statements to a session
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the Coplur Streamlit pages with AppTest sessions")
+    parser.add_argument('--users', type=int, default=100000, help="synthetic users to seed")
+    parser.add_argument('--sessions', type=int, default=8, help="concurrent sessions")
+    parser.add_argument('--admin-sessions', type=int, default=1, help="how many of the sessions are admins")
+    parser.add_argument('--iterations', type=int, default=3, help="journeys per session")
+    parser.add_argument('--pages', type=int, default=2, help="user table pages each admin journey steps through")
+    parser.add_argument('--timeout', type=float, default=120, help="seconds allowed for one rerun")
+    parser.add_argument('--seed', type=int, default=42, help="random seed")
+    parser.add_argument('--output', help="also write results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="keep Streamlit and slow-call log output")
+    return parser.parse_args()
+
+def seed_users(database_file, size, password_hash):
+    """Insert size synthetic users, every 50th an admin, sharing one precomputed hash"""
+    conn = sqlite3.connect(database_file)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    try:
+        conn.execute("BEGIN")
+        for start in range(0, size, SEED_BATCH_SIZE):
+            batch = []
+            for i in range(start, min(start + SEED_BATCH_SIZE, size)):
+                created_at = now - timedelta(seconds=(size - i) * 30)
+                batch.append((
+                    f'load{i}',
+                    f'load{i}@example.com',
+                    password_hash,
+                    'admin' if i % 50 == 0 else 'student',
+                    created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                ))
+            conn.executemany("""
+                INSERT INTO users (username, email, password_hash, role, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, batch)
+        conn.commit()
+    finally:
+        conn.close()
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (Linux reports KB); hashing workers are separate processes"""
+    if resource is None:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def allow_concurrent_apptests():
+    """
+    Let AppTest runs overlap in threads
+    Each AppTest run installs a mock Runtime, turns on the global.appTest
+    option and clears PagesManager.uses_pages_directory, and undoes or
+    recomputes them while other sessions' runs are still in flight. Keep the
+    last mock runtime available, the option on and the pages-directory flag
+    pinned for the whole test instead. Scripts are compiled on every run, and
+    concurrent compile() calls can fail on Python 3.11, so compiling is
+    serialised; scripts still execute concurrently.
+    """
+    from streamlit import config
+    from streamlit.commands import execution_control
+    from streamlit.elements.widgets import button
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.pages_manager import PagesManager
+    from streamlit.runtime.scriptrunner import script_runner
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    config.set_option('global.appTest', True)
+    last_runtime = {}
+    original_instance = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            last_runtime['runtime'] = cls._instance
+        elif 'runtime' in last_runtime:
+            return last_runtime['runtime']
+        return original_instance(cls)
+
+    def exists(cls):
+        # Widgets read this to find their st.form; a False here drops the form ID
+        if cls._instance is not None:
+            last_runtime['runtime'] = cls._instance
+        return 'runtime' in last_runtime
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+
+    compile_lock = threading.Lock()
+    get_bytecode = ScriptCache.get_bytecode
+
+    def locked_get_bytecode(self, script_path):
+        with compile_lock:
+            return get_bytecode(self, script_path)
+
+    ScriptCache.get_bytecode = locked_get_bytecode
+
+    # These modules only read the flag, so a subclass with it pinned can stand in
+    class PinnedPagesManager(PagesManager):
+        uses_pages_directory = (REPO_ROOT / 'pages').is_dir()
+
+    for module in (script_runner, button, execution_control):
+        module.PagesManager = PinnedPagesManager
+
+class StatementCounter:
+    """
+    Counts SQL statements run on pooled connections, per session
+    Statements run by a script rerun are attributed through the session's
+    SESSION_KEY marker; those from background threads (the database writer,
+    the auth event writer) are counted as background.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+
+    def __call__(self, statement):
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx(suppress_warning=True)
+        session = None
+        if ctx is not None:
+            try:
+                session = ctx.session_state[SESSION_KEY]
+            except KeyError:
+                pass
+        with self._lock:
+            self._counts[session] += 1
+
+    def count(self, session):
+        with self._lock:
+            return self._counts[session]
+
+    def install(self, database):
+        """Trace every connection the database module opens from now on"""
+        open_connection = database._open_connection
+
+        def traced_open(path):
+            conn = open_connection(path)
+            conn.set_trace_callback(self)
+            return conn
+
+        database._open_connection = traced_open
+
+class Session:
+    """One simulated browser session driving AppTest reruns and recording each one"""
+
+    def __init__(self, name, username, password, counter, timeout, record):
+        from streamlit.testing.v1 import AppTest
+        self.name = name
+        self.username = username
+        self.password = password
+        self.counter = counter
+        self.record = record
+        self.at = AppTest.from_file(str(REPO_ROOT / 'main.py'), default_timeout=timeout)
+        self.at.session_state[SESSION_KEY] = name
+
+    def rerun(self, step, action=None):
+        """Apply action (widget changes on self.at) and time the resulting rerun"""
+        statements = self.counter.count(self.name)
+        started = time.perf_counter()
+        error = None
+        try:
+            if action:
+                action(self.at)
+            self.at.run()
+            if self.at.exception:
+                error = self.at.exception[0].message
+            else:
+                # main.py shows unexpected errors on the page instead of raising them
+                error = next((element.value for element in self.at.error
+                              if element.value.startswith("Error details:")), None)
+        except StopIteration:
+            error = "Expected widget not found"
+        except Exception as e:
+            error = repr(e)
+        elapsed = (time.perf_counter() - started) * 1000
+        self.record(step, elapsed, self.counter.count(self.name) - statements, error)
+        return error is None
+
+    def form_input(self, form_id, label):
+        # Labels repeat across forms, e.g. "Password" on the login and registration forms
+        return next(widget for widget in self.at.text_input
+                    if widget.form_id == form_id and widget.label == label)
+
+    def button(self, label):
+        return next(widget for widget in self.at.button if widget.label == label)
+
+    def logged_in(self):
+        return SESSION_KEY in self.at.session_state and 'authenticated' in self.at.session_state \
+            and self.at.session_state['authenticated']
+
+    def login(self):
+        def submit(at):
+            self.form_input("login_form", "Username").input(self.username)
+            self.form_input("login_form", "Password").input(self.password)
+            self.button("Login").click()
+
+        self.rerun('main: open', lambda at: at.switch_page('main.py'))
+        ok = self.rerun('main: log in', submit)
+        if ok and not self.logged_in():
+            self.record('main: log in', 0.0, 0, "Login rejected")
+            return False
+        return ok
+
+    def student_journey(self, rng):
+        if not self.login():
+            return
+        self.rerun('student: open', lambda at: at.switch_page('pages/student.py'))
+        # The form stays open across logins once it has been shown in this session
+        if not any(widget.label == "Current Password" for widget in self.at.text_input):
+            self.rerun('student: password form', lambda at: self.button("🔐 Change Password").click())
+
+        new_password = LOAD_PASSWORDS[1] if self.password == LOAD_PASSWORDS[0] else LOAD_PASSWORDS[0]
+
+        def submit(at):
+            self.form_input("password_change_form", "Current Password").input(self.password)
+            self.form_input("password_change_form", "New Password").input(new_password)
+            self.form_input("password_change_form", "Confirm New Password").input(new_password)
+            self.button("Change Password").click()
+
+        # A successful change logs the session out
+        if self.rerun('student: change password', submit) and not self.logged_in():
+            self.password = new_password
+
+    def admin_journey(self, rng, pages, users):
+        if not self.logged_in() and not self.login():
+            return
+        self.rerun('admin: open', lambda at: at.switch_page('pages/admin.py'))
+        for _ in range(pages):
+            self.rerun('admin: next page', lambda at: at.button(key='users_next_page').click())
+        prefix = f'load{rng.randrange(users)}'[:6]
+        self.rerun('admin: search', lambda at: at.text_input(key='users_search').input(prefix))
+        self.rerun('admin: clear search', lambda at: at.text_input(key='users_search').input(''))
+
+def summarize(step, latencies, statements, errors):
+    latencies = sorted(latencies)
+    return {
+        'step': step,
+        'reruns': len(latencies),
+        'errors': len(errors),
+        'error_samples': sorted(set(message[:200] for message in errors))[:3],
+        'mean_ms': statistics.fmean(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+        'statements_mean': statistics.fmean(statements) if statements else 0.0,
+        'statements_max': max(statements) if statements else 0,
+    }
+
+def main():
+    args = parse_args()
+    if args.admin_sessions > args.sessions:
+        raise SystemExit("--admin-sessions cannot exceed --sessions")
+
+    # Configure the modules before they are imported: a scratch database and
+    # secret key, and login limits lifted since every session logs in from one address
+    scratch_dir = tempfile.mkdtemp(prefix='coplur_pages_')
+    database_file = os.path.join(scratch_dir, 'pages.db')
+    os.environ.update({
+        'COPLUR_DATABASE_FILE': database_file,
+        'COPLUR_SECRET_KEY_FILE': os.path.join(scratch_dir, 'secret_key'),
+        'COPLUR_LOGIN_USER_BURST': '1000000000',
+        'COPLUR_LOGIN_IP_BURST': '1000000000',
+    })
+    import database
+    import passwords
+    import streamlit.logger
+    from streamlit import config
+    if not args.verbose:
+        # Deprecation notices and slow-call warnings would be logged on every rerun;
+        # Streamlit re-applies logger.level whenever its config is parsed
+        config.set_option('logger.level', 'error')
+        streamlit.logger.set_log_level('error')
+        logging.getLogger('metrics').setLevel(logging.ERROR)
+
+    rng = random.Random(args.seed)
+    counter = StatementCounter()
+    lock = threading.Lock()
+    latencies = defaultdict(list)
+    statements = defaultdict(list)
+    errors = defaultdict(list)
+
+    def record(step, elapsed_ms, statement_count, error=None):
+        with lock:
+            if error is not None:
+                errors[step].append(error)
+            if elapsed_ms:
+                latencies[step].append(elapsed_ms)
+                statements[step].append(statement_count)
+
+    try:
+        started = time.perf_counter()
+        seed_users(database_file, args.users, passwords.bcrypt_hash(LOAD_PASSWORDS[0], database.BCRYPT_ROUNDS))
+        print(f"Seeded {args.users:,} users in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        counter.install(database)
+        allow_concurrent_apptests()
+        database.close_pool()  # Reopen pooled connections with the trace callback
+        rss_before = peak_rss_mb()
+
+        # Seeded user i is an admin when i % 50 == 0; give each session its own account
+        admin_ids = list(range(0, args.users, 50))
+        student_ids = [i for i in range(args.users) if i % 50 != 0]
+        if len(admin_ids) < args.admin_sessions or len(student_ids) < args.sessions - args.admin_sessions:
+            raise SystemExit("Not enough seeded users for that many sessions; raise --users")
+
+        sessions = []
+        for n in range(args.sessions):
+            is_admin = n < args.admin_sessions
+            user_index = admin_ids[n] if is_admin else student_ids[n - args.admin_sessions]
+            session = Session(f'session{n}', f'load{user_index}', LOAD_PASSWORDS[0], counter, args.timeout, record)
+            sessions.append((session, is_admin, random.Random(rng.random())))
+
+        def drive(session, is_admin, session_rng):
+            for _ in range(args.iterations):
+                if is_admin:
+                    session.admin_journey(session_rng, args.pages, args.users)
+                else:
+                    session.student_journey(session_rng)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=drive, args=session) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        database.close_pool()
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    results = [summarize(step, latencies[step], statements[step], errors[step]) for step in sorted(set(latencies) | set(errors))]
+    for result in results:
+        print(f"{result['step']:<26} {result['reruns']:5d} reruns  p50={result['p50_ms']:8.1f}ms "
+              f"p95={result['p95_ms']:8.1f}ms p99={result['p99_ms']:8.1f}ms "
+              f"sql/rerun={result['statements_mean']:6.1f} (max {result['statements_max']}) "
+              f"errors={result['errors']}", file=sys.stderr)
+        for sample in result['error_samples']:
+            print(f"    {sample}", file=sys.stderr)
+
+    total_reruns = sum(result['reruns'] for result in results)
+    report = {
+        'users': args.users,
+        'sessions': args.sessions,
+        'admin_sessions': args.admin_sessions,
+        'iterations': args.iterations,
+        'bcrypt_rounds': database.BCRYPT_ROUNDS,
+        'hash_workers': database.HASH_WORKERS,
+        'cpu_count': os.cpu_count(),
+        'elapsed_s': elapsed,
+        'reruns': total_reruns,
+        'reruns_per_s': total_reruns / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_mb_before_sessions': rss_before,
+        'background_statements': counter.count(None),
+        'results': results,
+    }
+    print(f"{total_reruns} reruns in {elapsed:.1f}s, peak RSS {report['peak_rss_mb']} MB", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Load test for the JSON auth service.
+
+Drives /login and /users/<id> lookups from concurrent clients, each holding
+one keep-alive connection, and reports requests per second and latency
+percentiles. By default it starts a service on a scratch database and a free
+port; pass --url to test a running service instead.
+
+Usage:
+    python benchmarks/load_test_service.py --clients 16 --duration 10
+    python benchmarks/load_test_service.py --url http://127.0.0.1:8600 --username admin --password Admin123!
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the Coplur auth service")
+    parser.add_argument('--url', help="service base URL (default: start a scratch service)")
+    parser.add_argument('--username', default='admin', help="account used for logins and the lookup token")
+    parser.add_argument('--password', default='Admin123!')
+    parser.add_argument('--clients', type=int, default=8, help="concurrent keep-alive clients")
+    parser.add_argument('--duration', type=float, default=10, help="seconds per scenario")
+    parser.add_argument('--scenarios', nargs='+', choices=['login', 'lookup'], default=['login', 'lookup'])
+    parser.add_argument('--workers', type=int, help="worker threads for the scratch service")
+    parser.add_argument('--output', help="also write results to this JSON file")
+    return parser.parse_args()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_service(scratch_dir, workers):
+    """Start auth_service.py on a scratch database and wait until it answers"""
+    port = free_port()
+    # Every client logs in as one user from one address, so lift the login rate limits
+    env = dict(os.environ, COPLUR_DATABASE_FILE=os.path.join(scratch_dir, 'service.db'),
+               COPLUR_SECRET_KEY_FILE=os.path.join(scratch_dir, 'secret_key'),
+               COPLUR_LOGIN_USER_BURST='1000000000', COPLUR_LOGIN_IP_BURST='1000000000')
+    command = [sys.executable, str(REPO_ROOT / 'auth_service.py'), '--port', str(port)]
+    if workers:
+        command += ['--workers', str(workers)]
+    process = subprocess.Popen(command, cwd=scratch_dir, env=env)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return process, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Auth service did not start within 60 seconds")
+
+def request_json(conn, method, path, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read() or b'{}')
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run_scenario(name, url, make_request, clients, duration):
+    """Run make_request(conn) from every client until the duration elapses"""
+    parts = urlsplit(url)
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        local_latencies = []
+        local_statuses = Counter()
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                status = make_request(conn)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+                status = 'connection_error'
+            local_latencies.append((time.perf_counter() - started) * 1000)
+            local_statuses[status] += 1
+        conn.close()
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'scenario': name,
+        'clients': clients,
+        'requests': len(latencies),
+        'ok': statuses.get(200, 0),
+        'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        'requests_per_s': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) if latencies else 0.0,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else 0.0,
+    }
+    print(f"{name:<7} {result['requests_per_s']:9.1f} req/s  p50={result['p50_ms']:7.2f}ms "
+          f"p95={result['p95_ms']:7.2f}ms p99={result['p99_ms']:7.2f}ms statuses={result['statuses']}",
+          file=sys.stderr)
+    return result
+
+def main():
+    args = parse_args()
+    scratch_dir = None
+    process = None
+    url = args.url
+    try:
+        if not url:
+            scratch_dir = tempfile.mkdtemp(prefix='coplur_service_')
+            process, url = start_service(scratch_dir, args.workers)
+
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=30)
+        status, login = request_json(conn, 'POST', '/login',
+                                     {'username': args.username, 'password': args.password})
+        conn.close()
+        if status != 200:
+            raise SystemExit(f"Login as {args.username} failed: {status} {login}")
+        token = login['token']
+        user_path = f"/users/{login['user']['id']}"
+        credentials = {'username': args.username, 'password': args.password}
+
+        scenarios = {
+            'login': lambda c: request_json(c, 'POST', '/login', credentials)[0],
+            'lookup': lambda c: request_json(c, 'GET', user_path, token=token)[0],
+        }
+        results = [
+            run_scenario(name, url, scenarios[name], args.clients, args.duration)
+            for name in args.scenarios
+        ]
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {'url': args.url or 'scratch service', 'cpu_count': os.cpu_count(), 'results': results}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
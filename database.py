@@ -1,323 +1,2829 @@
+import atexit
+import base64
+import contextvars
+import copy
+import csv
+import functools
+import inspect
+import io
+import json
 import sqlite3
-import bcrypt
+import multiprocessing
 import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
 from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+import passwords
+from membership import BloomFilter
 
 # Database configuration
-DATABASE_FILE = 'coplur_users.db'
+DATABASE_FILE = os.environ.get('COPLUR_DATABASE_FILE', 'coplur_users.db')
+
+# Connection pool configuration
+POOL_SIZE = int(os.environ.get('COPLUR_DB_POOL_SIZE', '8'))
+POOL_TIMEOUT = float(os.environ.get('COPLUR_DB_POOL_TIMEOUT', '10'))
+STATEMENT_CACHE_SIZE = 256
+
+# Instrumentation: calls whose DB time exceeds this are kept in the slow-query log
+SLOW_QUERY_MS = float(os.environ.get('COPLUR_SLOW_QUERY_MS', '100'))
+METRICS_PORT = int(os.environ.get('COPLUR_METRICS_PORT', '0'))  # 0 disables the HTTP endpoint
+
+# Password hashing service configuration (0 workers hashes inline)
+HASH_WORKERS = int(os.environ.get('COPLUR_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.environ.get('COPLUR_HASH_QUEUE_LIMIT', '16'))
+SERVER_BUSY_MESSAGE = "Server is busy, please try again in a moment"
+WRITE_OUTCOME_UNKNOWN_MESSAGE = "The database writer timed out; the change may still be saved, please check before retrying"
+
+# Password hasher configuration; existing hashes are upgraded on next login
+PASSWORD_SCHEME = os.environ.get('COPLUR_PASSWORD_SCHEME', 'bcrypt')
+BCRYPT_ROUNDS = int(os.environ.get('COPLUR_BCRYPT_ROUNDS', '12'))
+SCRYPT_LOG_N = int(os.environ.get('COPLUR_SCRYPT_LOG_N', '14'))
+SCRYPT_R = int(os.environ.get('COPLUR_SCRYPT_R', '8'))
+SCRYPT_P = int(os.environ.get('COPLUR_SCRYPT_P', '1'))
+
+# Read-through cache for user directory lookups (entries, not bytes)
+USER_CACHE_SIZE = int(os.environ.get('COPLUR_USER_CACHE_SIZE', '512'))
+
+# Bloom-filter membership index for username/email availability checks
+MEMBERSHIP_ERROR_RATE = 0.01
+MEMBERSHIP_MIN_CAPACITY = 1024
+MEMBERSHIP_SYNC_INTERVAL = 1.0  # Seconds between checks for rows added by other processes
+
+# Write-behind auth event log: events are group-committed every batch or interval, whichever comes first
+AUTH_EVENT_QUEUE_SIZE = int(os.environ.get('COPLUR_AUTH_EVENT_QUEUE_SIZE', '10000'))  # Events beyond this are dropped
+AUTH_EVENT_BATCH_SIZE = int(os.environ.get('COPLUR_AUTH_EVENT_BATCH_SIZE', '256'))
+AUTH_EVENT_FLUSH_MS = float(os.environ.get('COPLUR_AUTH_EVENT_FLUSH_MS', '200'))
+AUTH_EVENT_TYPES = (
+    'login_success', 'login_failure', 'login_throttled',
+    'user_created', 'users_imported', 'user_updated', 'user_deleted',
+    'password_reset', 'password_changed', 'logout',
+)
+
+# Single writer thread for user writes: queued jobs are group-committed up to a batch at a time
+WRITE_QUEUE_SIZE = int(os.environ.get('COPLUR_WRITE_QUEUE_SIZE', '1000'))  # Writes beyond this get "server busy"
+WRITE_BATCH_SIZE = int(os.environ.get('COPLUR_WRITE_BATCH_SIZE', '32'))
+WRITE_TIMEOUT = float(os.environ.get('COPLUR_WRITE_TIMEOUT', '30'))  # Seconds a caller waits for its commit
+
+# Login analytics rollups: buckets are created_at prefixes in these formats (UTC)
+AUTH_ROLLUP_GRANULARITIES = {'minute': '%Y-%m-%d %H:%M', 'hour': '%Y-%m-%d %H', 'day': '%Y-%m-%d'}
+
+# User listing configuration
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 200
+USER_LIST_SORTS = {
+    'newest': ('created_at', 'DESC'),
+    'oldest': ('created_at', 'ASC'),
+    'username': ('username', 'ASC'),
+}
+
+# User search: the trigram index only answers queries of at least this many characters
+SEARCH_MIN_SUBSTRING = 3
+
+# User export configuration
+EXPORT_FIELDS = ('id', 'username', 'email', 'role', 'created_at')
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_CHUNK_SIZE = 1000
+
+# Usernames/emails per duplicate lookup in bulk imports
+BULK_LOOKUP_CHUNK = 400
+
+# Applied once to every pooled connection when it is opened
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),        # Readers don't block the writer
+    ('synchronous', 'NORMAL'),      # Safe with WAL, avoids an fsync per commit
+    ('cache_size', -16000),         # ~16 MB page cache per connection
+    ('mmap_size', 268435456),       # Memory-map up to 256 MB of the file
+    ('busy_timeout', 5000),         # Wait up to 5 s for a competing writer
+    ('temp_store', 'MEMORY'),
+)
+
+# Named statements that read users, with sample parameters for EXPLAIN QUERY PLAN.
+# scripts/audit_query_plans.py fails if a hot one scans users; `bounded` marks
+# statements whose index-ordered scan is cut short by a LIMIT.
+QUERY_REGISTRY = {}
+
+def _register_query(name, sql, params=(), hot=True, bounded=False):
+    """Record a statement for the query-plan audit and return its SQL unchanged"""
+    QUERY_REGISTRY[name] = {'sql': sql, 'params': tuple(params), 'hot': hot, 'bounded': bounded}
+    return sql
+
+def _open_connection(database):
+    """Open a connection with CONNECTION_PRAGMAS applied"""
+    conn = sqlite3.connect(
+        database,
+        check_same_thread=False,  # Connections move between script threads
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    conn.row_factory = sqlite3.Row  # Enable column access by name
+    for pragma, value in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
+
+class _ConnectionPool:
+    """Thread-safe pool of pre-tuned SQLite connections shared by script threads"""
+
+    def __init__(self, database, max_size, timeout):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = []
+        self._created = 0
+        self._in_use = 0
+        self._condition = threading.Condition()
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'timeouts': 0,
+            'discarded': 0,
+        }
+
+    def _open(self):
+        """Open and tune a new connection"""
+        return _open_connection(self.database)
+
+    def acquire(self):
+        """Check out a connection, waiting up to the pool timeout"""
+        started = None
+        with self._condition:
+            while not self._idle and self._created >= self.max_size:
+                if started is None:
+                    started = time.perf_counter()
+                    self._stats['waits'] += 1
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0 or not self._condition.wait(remaining):
+                    if not self._idle and self._created >= self.max_size:
+                        self._stats['timeouts'] += 1
+                        raise sqlite3.OperationalError("Connection pool exhausted")
+
+            if started is not None:
+                waited = time.perf_counter() - started
+                self._stats['wait_time_total'] += waited
+                self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+
+            self._stats['checkouts'] += 1
+            self._in_use += 1
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        # Open outside the lock so other threads aren't blocked on disk I/O
+        try:
+            return self._open()
+        except sqlite3.Error:
+            with self._condition:
+                self._created -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding it if it is unusable"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._condition:
+                self._created -= 1
+                self._in_use -= 1
+                self._stats['discarded'] += 1
+                self._condition.notify()
+            return
+
+        with self._condition:
+            self._in_use -= 1
+            self._idle.append(conn)
+            self._condition.notify()
+
+    def close(self):
+        """Close all idle connections"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        """Snapshot of pool size and wait statistics"""
+        with self._condition:
+            stats = dict(self._stats)
+            stats.update({
+                'database': self.database,
+                'max_size': self.max_size,
+                'size': self._created,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+            })
+        stats['wait_time_avg'] = (
+            stats['wait_time_total'] / stats['waits'] if stats['waits'] else 0.0
+        )
+        return stats
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    """Return the pool for the current DATABASE_FILE, rebuilding it if the path changed"""
+    global _pool
+    pool = _pool
+    if pool is None or pool.database != DATABASE_FILE:
+        with _pool_lock:
+            if _pool is None or _pool.database != DATABASE_FILE:
+                if _pool is not None:
+                    _pool.close()
+                _pool = _ConnectionPool(DATABASE_FILE, POOL_SIZE, POOL_TIMEOUT)
+            pool = _pool
+    return pool
+
+@contextmanager
+def get_db_connection():
+    """Context manager that checks a tuned connection out of the shared pool"""
+    started = time.perf_counter()
+    pool = _get_pool()
+    try:
+        conn = pool.acquire()
+        try:
+            yield conn
+        finally:
+            pool.release(conn)
+    except sqlite3.Error:
+        _record_db_error()
+        raise
+    finally:
+        _record_db_time(time.perf_counter() - started)
+
+_TABLE_VERSION_SQL = _register_query(
+    'table_version', "SELECT version FROM table_versions WHERE name = ?", ('users',)
+)
+
+class _DataVersionWatcher:
+    """
+    Detects commits made by other connections or processes via PRAGMA data_version
+    With a table name, commits that left that table's trigger-maintained version
+    unchanged (e.g. auth event batches) are ignored.
+    """
+
+    def __init__(self, table=None):
+        self.table = table
+        self._conn = None
+        self._database = None
+        self._data_version = None
+        self._table_version = None
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """True if the watched data changed since the last call, on first use, or after DATABASE_FILE changes"""
+        with self._lock:
+            try:
+                if self._conn is None or self._database != DATABASE_FILE:
+                    if self._conn is not None:
+                        self._conn.close()
+                    # A dedicated connection that never writes, so PRAGMA data_version
+                    # changes exactly when any other connection commits
+                    self._conn = sqlite3.connect(DATABASE_FILE, check_same_thread=False)
+                    self._database = DATABASE_FILE
+                    self._data_version = None
+                data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                data_version = None
+            
+            changed = data_version is None or data_version != self._data_version
+            self._data_version = data_version
+            if not changed or self.table is None:
+                return changed
+            
+            # Something was committed; only report it if it touched the watched table
+            try:
+                row = self._conn.execute(_TABLE_VERSION_SQL, (self.table,)).fetchone()
+                table_version = row[0] if row else None
+            except sqlite3.Error:
+                table_version = None  # Not migrated yet
+            changed = table_version is None or table_version != self._table_version
+            self._table_version = table_version
+            return changed
+
+class _UserCache:
+    """Bounded LRU read-through cache for user directory lookups"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so in-flight loads can't store stale data
+        self._generation = 0
+        self._watcher = _DataVersionWatcher('users')
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'external_invalidations': 0,
+        }
+
+    def _check_external_writes(self):
+        """Clear the cache if another connection or process committed since the last check"""
+        with self._lock:
+            if not self._watcher.changed():
+                return
+            if self._entries:
+                self._stats['external_invalidations'] += 1
+            self._entries.clear()
+            self._generation += 1
+
+    def get_or_load(self, key, loader):
+        """Return a copy of the cached value for key, calling loader() on a miss"""
+        if self.max_size <= 0:
+            return loader()
+        
+        self._check_external_writes()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return copy.deepcopy(self._entries[key])
+            self._stats['misses'] += 1
+            generation = self._generation
+        
+        value = loader()
+        
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return copy.deepcopy(value)
+
+    def invalidate(self):
+        """Drop every cached entry after a write"""
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+            self._stats['invalidations'] += 1
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._entries), 'max_size': self.max_size})
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+_user_cache = _UserCache(USER_CACHE_SIZE)
+
+_COUNT_USERS_SQL = _register_query('count_users', "SELECT COUNT(*) FROM users", hot=False)
+_ALL_NAMES_SQL = _register_query('membership_rebuild', "SELECT id, username, email FROM users", hot=False)
+_NAMES_AFTER_ID_SQL = _register_query(
+    'membership_sync', "SELECT id, username, email FROM users WHERE id > ?", (1000,)
+)
+
+class _MembershipIndex:
+    """
+    Bloom filters over every username and email, built in the background at startup
+    A miss is definitive for rows this index has seen, so most availability
+    checks never reach SQLite; a hit still needs an exact lookup, and until the
+    first build finishes every check is a hit. Local writes update the filters
+    directly, and rows inserted by other processes are picked up by id at most
+    every MEMBERSHIP_SYNC_INTERVAL seconds. Builds and syncs only ever run on
+    the index's own thread, so a caller never scans the table or waits for a
+    second pooled connection. The UNIQUE constraints remain the final guard
+    against duplicates.
+    """
+
+    def __init__(self, error_rate):
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._usernames = None
+        self._emails = None
+        self._database = None
+        self._max_id = 0
+        self._removed = 0  # Deleted or renamed entries still set in the filters
+        self._next_sync = 0.0
+        self._maintaining = False  # A build or sync thread is running
+        self._pending_adds = None  # Local writes made while a build is scanning
+        self._watcher = _DataVersionWatcher('users')
+        self._stats = {
+            'checks': 0,
+            'definite_misses': 0,
+            'unindexed_checks': 0,
+            'confirmed_taken': 0,
+            'false_positives': 0,
+            'rebuilds': 0,
+            'syncs': 0,
+            'maintenance_errors': 0,
+        }
+
+    def start_build(self):
+        """Build the filters in the background, e.g. once the schema is known to be current"""
+        with self._lock:
+            self._maintain_in_background(rebuild=True)
+
+    def _maintain_in_background(self, rebuild):
+        # Called with _lock held; at most one build or sync runs at a time
+        if self._maintaining:
+            return
+        self._maintaining = True
+        threading.Thread(target=self._maintain, args=(rebuild,), name='coplur-membership', daemon=True).start()
+
+    def _maintain(self, rebuild):
+        try:
+            if rebuild:
+                self._rebuild()
+            else:
+                self._sync()
+        except Exception:
+            with self._lock:
+                self._stats['maintenance_errors'] += 1
+                self._pending_adds = None
+        finally:
+            with self._lock:
+                self._maintaining = False
+
+    def _rebuild(self):
+        """Load every username and email into fresh filters sized for twice the current rows"""
+        database = DATABASE_FILE
+        with self._lock:
+            self._pending_adds = []
+        self._watcher.changed()  # Baseline first, so commits during the scan are caught by the next sync
+        max_id = 0
+        with get_db_connection() as conn:
+            total = conn.execute(_COUNT_USERS_SQL).fetchone()[0]
+            capacity = max(MEMBERSHIP_MIN_CAPACITY, total * 2)
+            usernames = BloomFilter(capacity, self.error_rate)
+            emails = BloomFilter(capacity, self.error_rate)
+            for row in conn.execute(_ALL_NAMES_SQL):
+                usernames.add(row['username'])
+                emails.add(row['email'])
+                max_id = max(max_id, row['id'])
+        
+        with self._lock:
+            # Renames committed during the scan may not be in it, and a sync only finds new ids
+            for username, email in self._pending_adds:
+                usernames.add(username)
+                emails.add(email)
+            self._pending_adds = None
+            self._usernames, self._emails = usernames, emails
+            self._database = database
+            self._max_id = max_id
+            self._removed = 0
+            self._next_sync = time.monotonic() + MEMBERSHIP_SYNC_INTERVAL
+            self._stats['rebuilds'] += 1
+
+    def _sync(self):
+        """Add rows inserted by other processes since the last build or sync"""
+        if not self._watcher.changed():
+            return
+        with self._lock:
+            after_id = self._max_id
+        with get_db_connection() as conn:
+            rows = conn.execute(_NAMES_AFTER_ID_SQL, (after_id,)).fetchall()
+        with self._lock:
+            for row in rows:
+                self._usernames.add(row['username'])
+                self._emails.add(row['email'])
+                self._max_id = max(self._max_id, row['id'])
+            self._stats['syncs'] += 1
+
+    def might_contain(self, username=None, email=None):
+        """False means neither value is taken; True means the database must be asked"""
+        with self._lock:
+            self._stats['checks'] += 1
+            if self._usernames is None or self._database != DATABASE_FILE:
+                # Not built (yet) for this database: answer "maybe" and let the build catch up
+                self._stats['unindexed_checks'] += 1
+                self._maintain_in_background(rebuild=True)
+                return True
+            
+            # Saturated or stale filters still answer correctly, only with more false positives
+            if self._usernames.count > self._usernames.capacity \
+                    or self._removed > self._usernames.capacity // 4:
+                self._maintain_in_background(rebuild=True)
+            elif time.monotonic() >= self._next_sync:
+                self._next_sync = time.monotonic() + MEMBERSHIP_SYNC_INTERVAL
+                self._maintain_in_background(rebuild=False)
+            
+            found = (username is not None and username in self._usernames) or \
+                    (email is not None and email in self._emails)
+            if not found:
+                self._stats['definite_misses'] += 1
+            return found
+
+    def record_confirmation(self, taken):
+        """Count the outcome of the exact lookup that followed a hit"""
+        with self._lock:
+            if self._usernames is None:
+                return  # The check was unindexed, not a filter hit
+            self._stats['confirmed_taken' if taken else 'false_positives'] += 1
+
+    def add(self, username, email):
+        """Record a username and email just committed by this process"""
+        with self._lock:
+            if self._pending_adds is not None:
+                self._pending_adds.append((username, email))
+            if self._usernames is not None and self._database == DATABASE_FILE:
+                self._usernames.add(username)
+                self._emails.add(email)
+
+    def note_removed(self, count=1):
+        """Record entries that no longer exist but stay set until the next rebuild"""
+        with self._lock:
+            self._removed += count
+
+    def stats(self):
+        """Snapshot of index counters and filter sizes"""
+        with self._lock:
+            stats = dict(self._stats)
+            built = self._usernames is not None
+            stats.update({
+                'ready': built and self._database == DATABASE_FILE,
+                'entries': self._usernames.count if built else 0,
+                'capacity': self._usernames.capacity if built else 0,
+                'stale_entries': self._removed,
+                'size_bytes': self._usernames.size_bytes + self._emails.size_bytes if built else 0,
+            })
+        return stats
+
+_membership_index = _MembershipIndex(MEMBERSHIP_ERROR_RATE)
+
+_INSERT_AUTH_EVENT_SQL = """
+    INSERT INTO auth_events (created_at, event_type, username, user_id, actor, client_address, detail)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+class _AuthEventWriter:
+    """
+    Background thread that group-commits auth events
+    record() only appends to a bounded queue, so request paths never wait for
+    a commit. The writer inserts up to AUTH_EVENT_BATCH_SIZE events per
+    transaction, waiting at most AUTH_EVENT_FLUSH_MS for a batch to fill. When
+    the queue is full new events are dropped and counted. Pending events are
+    written at interpreter exit.
+    """
+
+    _STOP = object()
+
+    def __init__(self, queue_size, batch_size, flush_interval):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = None
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._pending = 0  # Queued but not yet written or failed
+        self._stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0}
+
+    def record(self, row):
+        """Queue one auth_events row without blocking; returns False if it was dropped"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='coplur-auth-events', daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self._stats['dropped'] += 1
+                dropped = True
+            else:
+                self._stats['recorded'] += 1
+                self._pending += 1
+                dropped = False
+        if dropped:
+            metrics.registry.inc('coplur_auth_events_dropped_total')
+        return not dropped
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is self._STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        try:
+            with get_db_connection() as conn:
+                conn.executemany(_INSERT_AUTH_EVENT_SQL, batch)
+                conn.commit()
+            failed = 0
+        except sqlite3.Error:
+            failed = len(batch)
+        with self._lock:
+            self._stats['written'] += len(batch) - failed
+            self._stats['failed'] += failed
+            self._stats['batches'] += 1
+            self._pending -= len(batch)
+            self._drained.notify_all()
+        if failed:
+            metrics.registry.inc('coplur_auth_events_failed_total', amount=failed)
+
+    def flush(self, timeout=None):
+        """Wait until every event queued so far is written; returns False on timeout"""
+        with self._lock:
+            return self._drained.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=5.0):
+        """Write pending events and stop the thread; the next record() starts a new one"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return True
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return False
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def stats(self):
+        """Snapshot of writer counters and queue depth"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = self._pending
+        return stats
+
+_auth_event_writer = _AuthEventWriter(AUTH_EVENT_QUEUE_SIZE, AUTH_EVENT_BATCH_SIZE, AUTH_EVENT_FLUSH_MS / 1000)
+atexit.register(_auth_event_writer.close)
+
+class _WriteQueue:
+    """
+    Dedicated thread that owns the write connection for user writes
+    submit() queues a job, a function taking a cursor, and returns a Future.
+    The thread runs whatever is queued (up to WRITE_BATCH_SIZE jobs) in one
+    IMMEDIATE transaction, each job in its own savepoint so one that raises is
+    rolled back alone, commits once and only then resolves the futures. Writers
+    in this process so never contend for SQLite's lock, and a burst of
+    registrations costs one commit per batch. Jobs must not commit, and side
+    effects such as cache invalidation belong to the caller, after the result.
+    """
+
+    _STOP = object()
+
+    def __init__(self, queue_size, batch_size):
+        self.batch_size = max(1, batch_size)
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = None
+        self._lock = threading.Lock()
+        self._conn = None  # Only touched by the writer thread
+        self._database = None
+        self._stats = {'jobs': 0, 'failed': 0, 'rejected': 0, 'batches': 0, 'max_batch': 0}
+
+    def submit(self, job):
+        """Queue job(cursor) without blocking; raises ServerBusyError if the queue is full"""
+        future = Future()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='coplur-writer', daemon=True)
+                self._thread.start()
+            try:
+                self._queue.put_nowait((job, future))
+            except queue.Full:
+                self._stats['rejected'] += 1
+                raise ServerBusyError(SERVER_BUSY_MESSAGE)
+        return future
+
+    def run(self, job):
+        """
+        Submit job and wait until it is committed; returns its result or raises its error
+        On timeout a job that has not started is cancelled and reported as failed;
+        one already running may still commit, so WriteOutcomeUnknownError is raised.
+        """
+        started = time.perf_counter()
+        future = None
+        try:
+            future = self.submit(job)
+            return future.result(WRITE_TIMEOUT)
+        except FutureTimeoutError:
+            _record_db_error()
+            if future.cancel():
+                raise sqlite3.OperationalError("Timed out waiting for the database writer")
+            raise WriteOutcomeUnknownError(WRITE_OUTCOME_UNKNOWN_MESSAGE)
+        except sqlite3.Error:
+            _record_db_error()
+            raise
+        finally:
+            _record_db_time(time.perf_counter() - started)
+
+    def _run(self):
+        while True:
+            # Group whatever is already waiting; under no load a job commits alone, at once
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is self._STOP
+            if stopping:
+                batch.pop()
+            if batch:
+                self._apply(batch)
+            if stopping:
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+                return
+
+    def _connection(self):
+        if self._conn is None or self._database != DATABASE_FILE:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._conn = _open_connection(DATABASE_FILE)
+            self._database = DATABASE_FILE
+        return self._conn
+
+    def _apply(self, batch):
+        batch = [(job, future) for job, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return  # Every job was cancelled by a caller that timed out
+        outcomes = []
+        try:
+            conn = self._connection()
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                cursor.execute("SAVEPOINT job")
+                try:
+                    outcomes.append((job(cursor), None))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO job")
+                    outcomes.append((None, e))
+                cursor.execute("RELEASE job")
+            conn.commit()
+        except sqlite3.Error as e:
+            try:
+                if self._conn is not None and self._conn.in_transaction:
+                    self._conn.rollback()
+            except sqlite3.Error:
+                self._conn.close()
+                self._conn = None
+            outcomes = [(None, e)] * len(batch)
+        
+        with self._lock:
+            self._stats['jobs'] += len(batch)
+            self._stats['failed'] += sum(1 for _, error in outcomes if error is not None)
+            self._stats['batches'] += 1
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(batch))
+        for (job, future), (result, error) in zip(batch, outcomes):
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def close(self, timeout=5.0):
+        """Finish queued writes, close the write connection and stop the thread; the next submit() starts a new one"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or not thread.is_alive():
+            return True
+        try:
+            self._queue.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return False
+        thread.join(timeout)
+        return not thread.is_alive()
+
+    def stats(self):
+        """Snapshot of writer counters and queue depth"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        return stats
+
+_write_queue = _WriteQueue(WRITE_QUEUE_SIZE, WRITE_BATCH_SIZE)
+atexit.register(_write_queue.close)
+
+# Who is acting and from where, for events recorded in this thread or task
+_audit_context = contextvars.ContextVar('coplur_audit_context', default=(None, None))
+
+def set_audit_context(actor=None, client_address=None):
+    """
+    Attribute auth events recorded from here on in this thread or task
+    actor: username of the logged-in user making changes (None for self-service and logins)
+    """
+    _audit_context.set((actor, client_address))
+
+def record_auth_event(event_type, username=None, user_id=None, detail=None):
+    """
+    Queue an auth event for the background writer; never waits for the database
+    Returns: False if the queue was full and the event was dropped
+    """
+    actor, client_address = _audit_context.get()
+    if username is not None:
+        username = str(username)[:100]  # Failed logins carry arbitrary input
+    created_at = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())  # Same format as CURRENT_TIMESTAMP
+    return _auth_event_writer.record(
+        (created_at, event_type, username, user_id, actor, client_address, detail)
+    )
+
+def flush_auth_events(timeout=5.0):
+    """Wait until queued auth events are committed; returns False on timeout"""
+    return _auth_event_writer.flush(timeout)
+
+def get_auth_event_stats():
+    """Get auth event writer counters, including events dropped on overflow"""
+    return _auth_event_writer.stats()
+
+def get_write_queue_stats():
+    """Get user write queue counters, including batches committed and writes rejected as busy"""
+    return _write_queue.stats()
+
+def get_membership_stats():
+    """Get availability index hit/miss counters and filter sizes"""
+    return _membership_index.stats()
+
+def get_cache_stats():
+    """Get user cache hit/miss counters"""
+    return _user_cache.stats()
+
+def get_pool_stats():
+    """Get connection pool size and wait statistics"""
+    return _get_pool().stats()
+
+def close_pool():
+    """Close idle pooled connections and the writer's connection (e.g. before deleting the database file)"""
+    _write_queue.close()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+
+# Per-call DB time, hashing time and error count of the innermost instrumented call
+_call_stats = contextvars.ContextVar('coplur_db_call_stats', default=None)
+slow_query_log = metrics.SlowCallLog(SLOW_QUERY_MS)
+
+metrics.registry.describe('coplur_db_calls_total', "Calls to public database functions")
+metrics.registry.describe('coplur_db_errors_total', "Database function calls that hit an error")
+metrics.registry.describe('coplur_db_call_duration_seconds', "Total latency of database function calls")
+metrics.registry.describe('coplur_db_query_duration_seconds', "Time spent holding pooled SQLite connections per call")
+metrics.registry.describe('coplur_password_hash_duration_seconds', "Time spent in bcrypt per call, including queueing")
+
+def _record_db_time(seconds):
+    stats = _call_stats.get()
+    if stats is not None:
+        stats['db'] += seconds
+
+def _record_hash_time(seconds):
+    stats = _call_stats.get()
+    if stats is not None:
+        stats['hash'] += seconds
+
+def _record_db_error():
+    stats = _call_stats.get()
+    if stats is not None:
+        stats['errors'] += 1
+    else:
+        metrics.registry.inc('coplur_db_errors_total', {'operation': 'unattributed'})
+
+def _record_call(operation, elapsed, stats):
+    labels = {'operation': operation}
+    metrics.registry.inc('coplur_db_calls_total', labels)
+    if stats['errors']:
+        metrics.registry.inc('coplur_db_errors_total', labels, stats['errors'])
+    metrics.registry.observe('coplur_db_call_duration_seconds', elapsed, labels)
+    if stats['db']:
+        metrics.registry.observe('coplur_db_query_duration_seconds', stats['db'], labels)
+    if stats['hash']:
+        metrics.registry.observe('coplur_password_hash_duration_seconds', stats['hash'], labels)
+    slow_query_log.record(
+        operation, stats['db'] * 1000,
+        total_ms=round(elapsed * 1000, 2), hash_ms=round(stats['hash'] * 1000, 2)
+    )
+
+def handle_db_operation(operation_func):
+    """Decorator that records call counts, errors and DB/hashing latency of a database function"""
+    operation = operation_func.__name__
+    
+    if inspect.isgeneratorfunction(operation_func):
+        @functools.wraps(operation_func)
+        def generator_wrapper(*args, **kwargs):
+            # Generators interleave with their consumer, so the stats are only
+            # installed while the generator itself runs, never across a yield
+            stats = {'db': 0.0, 'hash': 0.0, 'errors': 0}
+            started = time.perf_counter()
+            generator = operation_func(*args, **kwargs)
+
+            def step(resume):
+                token = _call_stats.set(stats)
+                try:
+                    return resume()
+                finally:
+                    _call_stats.reset(token)
+
+            try:
+                while True:
+                    try:
+                        item = step(lambda: next(generator))
+                    except StopIteration:
+                        return
+                    yield item
+            except sqlite3.Error:
+                raise  # Already counted by get_db_connection
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                # Run the generator's own cleanup (e.g. returning its connection) under its stats
+                step(generator.close)
+                _record_call(operation, time.perf_counter() - started, stats)
+        return generator_wrapper
+    
+    @functools.wraps(operation_func)
+    def wrapper(*args, **kwargs):
+        parent = _call_stats.get()
+        stats = {'db': 0.0, 'hash': 0.0, 'errors': 0}
+        token = _call_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            return operation_func(*args, **kwargs)
+        except sqlite3.Error:
+            raise  # Already counted by get_db_connection
+        except Exception:
+            stats['errors'] += 1
+            raise
+        finally:
+            _call_stats.reset(token)
+            if parent is not None:
+                parent['db'] += stats['db']
+                parent['hash'] += stats['hash']
+            _record_call(operation, time.perf_counter() - started, stats)
+    return wrapper
+
+def _stats_gauge(get_stats, keys):
+    """Expose selected entries of a stats dict as one gauge labelled by stat"""
+    def collect():
+        stats = get_stats()
+        return {(('stat', key),): stats[key] for key in keys}
+    return collect
+
+metrics.registry.gauge(
+    'coplur_db_pool',
+    _stats_gauge(lambda: get_pool_stats(), ('size', 'idle', 'in_use', 'checkouts', 'waits', 'wait_time_total', 'timeouts')),
+    "Connection pool state and wait statistics"
+)
+metrics.registry.gauge(
+    'coplur_user_cache',
+    _stats_gauge(lambda: get_cache_stats(), ('size', 'hits', 'misses', 'evictions', 'invalidations', 'external_invalidations')),
+    "User directory cache state and hit/miss counters"
+)
+metrics.registry.gauge(
+    'coplur_membership_index',
+    _stats_gauge(lambda: get_membership_stats(), (
+        'checks', 'definite_misses', 'unindexed_checks', 'confirmed_taken', 'false_positives',
+        'rebuilds', 'maintenance_errors', 'entries', 'stale_entries',
+    )),
+    "Username/email availability index counters"
+)
+metrics.registry.describe('coplur_auth_events_dropped_total', "Auth events dropped because the writer queue was full")
+metrics.registry.describe('coplur_auth_events_failed_total', "Auth events lost to database errors in the writer")
+metrics.registry.gauge(
+    'coplur_auth_event_writer',
+    _stats_gauge(lambda: get_auth_event_stats(), ('recorded', 'written', 'dropped', 'failed', 'batches', 'pending')),
+    "Auth event writer counters and queue depth"
+)
+metrics.registry.gauge(
+    'coplur_write_queue',
+    _stats_gauge(lambda: get_write_queue_stats(), ('jobs', 'failed', 'rejected', 'batches', 'max_batch', 'pending')),
+    "User write queue counters and depth"
+)
+metrics.registry.gauge(
+    'coplur_password_hashing',
+    _stats_gauge(lambda: get_hashing_stats(), ('submitted', 'rejected', 'inline', 'pool_failures')),
+    "Password hashing service counters"
+)
+
+def render_metrics():
+    """Get a Prometheus-style text snapshot of all metrics"""
+    return metrics.registry.render()
+
+def get_latency_summary():
+    """Get per-function call and error counts with estimated latency percentiles in milliseconds"""
+    summary = {}
+    for metric_name, prefix in [
+        ('coplur_db_call_duration_seconds', 'total'),
+        ('coplur_db_query_duration_seconds', 'db'),
+        ('coplur_password_hash_duration_seconds', 'hash'),
+    ]:
+        for row in metrics.registry.histogram_summary(metric_name):
+            entry = summary.setdefault(row['operation'], {'operation': row['operation']})
+            if prefix == 'total':
+                entry['calls'] = row['count']
+                entry['errors'] = metrics.registry.counter_value(
+                    'coplur_db_errors_total', {'operation': row['operation']}
+                )
+            entry[f'{prefix}_mean_ms'] = round(row['mean_ms'], 3)
+            entry[f'{prefix}_p95_ms'] = row['p95_ms']
+    return sorted(summary.values(), key=lambda entry: entry['operation'])
+
+def get_slow_queries():
+    """Get the most recent calls whose DB time exceeded SLOW_QUERY_MS, newest first"""
+    return slow_query_log.entries()
+
+def _migrate_create_users(cursor, context):
+    """Create users table with proper constraints and seed default admin and student"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL CHECK (role IN ('admin', 'student')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create default admin if none exists
+    cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO users (username, email, password_hash, role) 
+            VALUES (?, ?, ?, ?)
+        """, ('admin', 'admin@coplur.com', context['admin_password_hash'], 'admin'))
+    
+    # Create default student for demo purposes if none exists
+    cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'student'")
+    if cursor.fetchone()[0] == 0:
+        cursor.execute("""
+            INSERT INTO users (username, email, password_hash, role) 
+            VALUES (?, ?, ?, ?)
+        """, ('student', 'student@demo.com', context['student_password_hash'], 'student'))
+
+def _migrate_user_list_indexes(cursor, context):
+    """Indexes backing keyset pagination of the user listing"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_created_at 
+        ON users (created_at, id)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_role_created_at 
+        ON users (role, created_at)
+    """)
+
+def _migrate_role_counts(cursor, context):
+    """Trigger-maintained per-role user counters"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS role_counts (
+            role TEXT PRIMARY KEY,
+            user_count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    
+    # Backfill from users; recount in case the table predates versioning
+    cursor.execute("DELETE FROM role_counts")
+    cursor.execute("""
+        INSERT INTO role_counts (role, user_count)
+        SELECT r.role, (SELECT COUNT(*) FROM users WHERE users.role = r.role)
+        FROM (SELECT 'admin' AS role UNION ALL SELECT 'student') AS r
+    """)
+    
+    # Keep the counters exact on every write to users
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_role_count_insert
+        AFTER INSERT ON users
+        BEGIN
+            UPDATE role_counts SET user_count = user_count + 1 WHERE role = NEW.role;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_role_count_delete
+        AFTER DELETE ON users
+        BEGIN
+            UPDATE role_counts SET user_count = user_count - 1 WHERE role = OLD.role;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_role_count_update
+        AFTER UPDATE OF role ON users
+        WHEN OLD.role != NEW.role
+        BEGIN
+            UPDATE role_counts SET user_count = user_count - 1 WHERE role = OLD.role;
+            UPDATE role_counts SET user_count = user_count + 1 WHERE role = NEW.role;
+        END
+    """)
+
+def _migrate_role_username_index(cursor, context):
+    """Index for the role-filtered user listing sorted by username"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_role_username 
+        ON users (role, username)
+    """)
+
+def _migrate_auth_events(cursor, context):
+    """Append-only log of logins, registrations and admin changes"""
+    # No foreign key to users: events outlive the accounts they describe
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS auth_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TIMESTAMP NOT NULL,
+            event_type TEXT NOT NULL,
+            username TEXT,
+            user_id INTEGER,
+            actor TEXT,
+            client_address TEXT,
+            detail TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_auth_events_created_at 
+        ON auth_events (created_at)
+    """)
+
+def _migrate_table_versions(cursor, context):
+    """Trigger-maintained change counter for users, so caches can ignore unrelated commits"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO table_versions (name) VALUES ('users')")
+    for operation in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_{operation.lower()}
+            AFTER {operation} ON users
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'users';
+            END
+        """)
+
+def _migrate_auth_event_rollups(cursor, context):
+    """Per-minute, hour and day login and registration counters, maintained as events are inserted"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS auth_event_rollups (
+            granularity TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            login_successes INTEGER NOT NULL DEFAULT 0,
+            login_failures INTEGER NOT NULL DEFAULT 0,
+            login_throttled INTEGER NOT NULL DEFAULT 0,
+            registrations INTEGER NOT NULL DEFAULT 0,
+            distinct_users INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (granularity, bucket)
+        ) WITHOUT ROWID
+    """)
+    # Lets the trigger ask "has this user already logged in during this bucket?" with one probe
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_auth_events_login_user 
+        ON auth_events (username, created_at) WHERE event_type = 'login_success'
+    """)
+    
+    # Backfill from events logged before this migration; registrations are
+    # self-service sign-ups, i.e. user_created without an acting admin
+    cursor.execute("DELETE FROM auth_event_rollups")
+    lengths = {granularity: len(datetime(2000, 1, 1).strftime(bucket_format))
+               for granularity, bucket_format in AUTH_ROLLUP_GRANULARITIES.items()}
+    for granularity, length in lengths.items():
+        cursor.execute(f"""
+            INSERT INTO auth_event_rollups
+            SELECT ?, substr(created_at, 1, {length}),
+                   SUM(event_type = 'login_success'),
+                   SUM(event_type = 'login_failure'),
+                   SUM(event_type = 'login_throttled'),
+                   SUM(event_type = 'user_created' AND actor IS NULL),
+                   COUNT(DISTINCT CASE WHEN event_type = 'login_success' THEN username END)
+            FROM auth_events
+            WHERE event_type IN ('login_success', 'login_failure', 'login_throttled', 'user_created')
+            GROUP BY 2
+        """, (granularity,))
+    
+    # Every bucket string is a prefix of created_at, so rows in a bucket sort between
+    # the bucket and the bucket followed by '~' (above any digit, space or colon)
+    buckets = {granularity: f"substr(NEW.created_at, 1, {length})" for granularity, length in lengths.items()}
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_auth_events_rollup
+        AFTER INSERT ON auth_events
+        WHEN NEW.event_type IN ('login_success', 'login_failure', 'login_throttled', 'user_created')
+        BEGIN
+            INSERT OR IGNORE INTO auth_event_rollups (granularity, bucket) VALUES
+                {', '.join(f"('{granularity}', {bucket})" for granularity, bucket in buckets.items())};
+            UPDATE auth_event_rollups SET
+                login_successes = login_successes + (NEW.event_type = 'login_success'),
+                login_failures = login_failures + (NEW.event_type = 'login_failure'),
+                login_throttled = login_throttled + (NEW.event_type = 'login_throttled'),
+                registrations = registrations + (NEW.event_type = 'user_created' AND NEW.actor IS NULL),
+                distinct_users = distinct_users + (NEW.event_type = 'login_success' AND NOT EXISTS (
+                    SELECT 1 FROM auth_events
+                    WHERE event_type = 'login_success' AND username = NEW.username
+                      AND created_at >= auth_event_rollups.bucket
+                      AND created_at < auth_event_rollups.bucket || '~'
+                      AND id != NEW.id
+                ))
+            WHERE {' OR '.join(f"(granularity = '{granularity}' AND bucket = {bucket})"
+                               for granularity, bucket in buckets.items())};
+        END
+    """)
+
+def _migrate_user_search(cursor, context):
+    """Trigram full-text index over usernames and emails, kept in sync by triggers"""
+    try:
+        # External content: the index stores trigrams only and reads values from users
+        cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                username, email, content='users', content_rowid='id', tokenize='trigram'
+            )
+        """)
+    except sqlite3.OperationalError:
+        return  # No FTS5 trigram tokenizer (SQLite < 3.34); search_users falls back to prefix lookups
+    
+    cursor.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_insert
+        AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, username, email) VALUES (NEW.id, NEW.username, NEW.email);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_delete
+        AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, email)
+            VALUES ('delete', OLD.id, OLD.username, OLD.email);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_users_fts_update
+        AFTER UPDATE OF username, email ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, username, email)
+            VALUES ('delete', OLD.id, OLD.username, OLD.email);
+            INSERT INTO users_fts (rowid, username, email) VALUES (NEW.id, NEW.username, NEW.email);
+        END
+    """)
+
+def _migrate_session_versions(cursor, context):
+    """Per-user counter signed into session tokens; bumping it revokes every token issued before"""
+    cursor.execute("ALTER TABLE users ADD COLUMN session_version INTEGER NOT NULL DEFAULT 0")
+
+# Ordered schema migrations; PRAGMA user_version records the last one applied.
+# Append new steps with the next number, never edit or reorder shipped ones.
+MIGRATIONS = [
+    (1, "Create users table and seed default accounts", _migrate_create_users),
+    (2, "Add user listing indexes", _migrate_user_list_indexes),
+    (3, "Add trigger-maintained role counters", _migrate_role_counts),
+    (4, "Add role and username listing index", _migrate_role_username_index),
+    (5, "Add auth event log", _migrate_auth_events),
+    (6, "Add users change counter", _migrate_table_versions),
+    (7, "Add login analytics rollups", _migrate_auth_event_rollups),
+    (8, "Add trigram user search index", _migrate_user_search),
+    (9, "Add per-user session versions", _migrate_session_versions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# DATABASE_FILE whose schema is known to be current in this process
+_schema_checked_for = None
+_schema_lock = threading.Lock()
+
+def get_schema_version():
+    """Get the schema version recorded in the database"""
+    with get_db_connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _apply_migrations():
+    """Apply every pending migration in one transaction"""
+    version = get_schema_version()
+    if version >= SCHEMA_VERSION:
+        return
+    
+    # Seed passwords are only needed by the first migration; hash them before
+    # taking the write lock so it isn't held during bcrypt
+    context = {}
+    if version < 1:
+        context['admin_password_hash'] = hash_password('Admin123!')
+        context['student_password_hash'] = hash_password('Student123!')
+    
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        
+        # Another process may have migrated while we were hashing
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for number, description, migrate in MIGRATIONS:
+            if number > version:
+                migrate(cursor, context)
+                cursor.execute(f"PRAGMA user_version = {number}")
+        
+        conn.commit()
+    _user_cache.invalidate()
+
+@handle_db_operation
+def init_database():
+    """
+    Bring the database schema up to date
+    After the first successful call per process this is a single cached flag check.
+    """
+    global _schema_checked_for
+    if _schema_checked_for == DATABASE_FILE:
+        return
+    
+    with _schema_lock:
+        if _schema_checked_for != DATABASE_FILE:
+            _apply_migrations()
+            _schema_checked_for = DATABASE_FILE
+            # Build the availability index now rather than on the first registration
+            _membership_index.start_build()
+
+class ServerBusyError(Exception):
+    """Raised when the password hashing service or the write queue is at capacity"""
+
+class WriteOutcomeUnknownError(sqlite3.OperationalError):
+    """Raised when a queued write timed out after the writer had started it, so it may still commit"""
+
+class _HashingService:
+    """Bounded process pool that keeps bcrypt off the Streamlit script threads"""
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        # One slot per running job plus the allowed backlog
+        self._slots = threading.BoundedSemaphore(max(1, workers + queue_limit))
+        self._bulk_slots = threading.BoundedSemaphore(max(1, workers))
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'rejected': 0, 'inline': 0, 'pool_failures': 0}
+
+    def _get_executor(self):
+        """Start worker processes on first use"""
+        with self._lock:
+            if self._executor is None:
+                # Spawn rather than fork: the Streamlit server is multi-threaded
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _reset_executor(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._stats['pool_failures'] += 1
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, func, *args):
+        """Run func(*args) in a worker process, failing fast when the backlog is full"""
+        started = time.perf_counter()
+        try:
+            return self._run(func, *args)
+        finally:
+            _record_hash_time(time.perf_counter() - started)
+
+    def _use_inline(self):
+        # Worker processes re-import the main script and must never start a pool of their own;
+        # _inheriting is the flag multiprocessing itself checks while a child is bootstrapping
+        if self.workers <= 0 or multiprocessing.parent_process() is not None:
+            return True
+        return getattr(multiprocessing.current_process(), '_inheriting', False)
+
+    def _run(self, func, *args):
+        if self._use_inline():
+            with self._lock:
+                self._stats['inline'] += 1
+            return func(*args)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise ServerBusyError(SERVER_BUSY_MESSAGE)
+
+        try:
+            with self._lock:
+                self._stats['submitted'] += 1
+            try:
+                return self._get_executor().submit(func, *args).result()
+            except (BrokenProcessPool, OSError):
+                # Worker processes died or can't be started; hash inline this time
+                self._reset_executor()
+                return func(*args)
+        finally:
+            self._slots.release()
+
+    def _release_bulk_slot(self, _future=None):
+        self._slots.release()
+        self._bulk_slots.release()
+
+    def run_many(self, func, arg_list):
+        """
+        Run func over many argument tuples across the worker processes
+        Bulk work waits for free slots instead of failing fast, but never takes
+        more than one slot per worker so interactive logins keep the backlog.
+        """
+        started = time.perf_counter()
+        try:
+            return self._run_many(func, list(arg_list))
+        finally:
+            _record_hash_time(time.perf_counter() - started)
+
+    def _run_many(self, func, arg_list):
+        if self._use_inline():
+            with self._lock:
+                self._stats['inline'] += len(arg_list)
+            return [func(*args) for args in arg_list]
+        
+        futures = []
+        try:
+            for args in arg_list:
+                self._bulk_slots.acquire()
+                self._slots.acquire()
+                try:
+                    future = self._get_executor().submit(func, *args)
+                except BaseException:
+                    self._release_bulk_slot()
+                    raise
+                future.add_done_callback(self._release_bulk_slot)
+                futures.append(future)
+            with self._lock:
+                self._stats['submitted'] += len(futures)
+            return [future.result() for future in futures]
+        except (BrokenProcessPool, OSError):
+            self._reset_executor()
+            return [func(*args) for args in arg_list]
+
+    def stats(self):
+        """Snapshot of hashing service counters"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'workers': self.workers, 'queue_limit': self.queue_limit})
+        return stats
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+_hashing_service = _HashingService(HASH_WORKERS, HASH_QUEUE_LIMIT)
+
+class _BcryptHasher:
+    """bcrypt at a configurable cost; hashes are stored as bytes ($2b$<cost>$...)"""
+    name = 'bcrypt'
+
+    def __init__(self, rounds=BCRYPT_ROUNDS):
+        self.rounds = rounds
+
+    def identify(self, hashed):
+        return hashed[:3] in (b'$2a', b'$2b', b'$2y')
+
+    def hash_call(self, password):
+        return passwords.bcrypt_hash, (password, self.rounds)
+
+    def verify_call(self, password, hashed):
+        return passwords.bcrypt_verify, (password, hashed)
+
+    def needs_update(self, hashed):
+        return passwords.bcrypt_rounds(hashed) != self.rounds
+
+    def params(self):
+        return {'rounds': self.rounds}
+
+class _ScryptHasher:
+    """Stdlib hashlib.scrypt; hashes are stored as text ($scrypt$ln=..,r=..,p=..$salt$key)"""
+    name = 'scrypt'
+
+    def __init__(self, log_n=SCRYPT_LOG_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+
+    def identify(self, hashed):
+        return hashed.startswith(passwords.SCRYPT_PREFIX.encode('ascii'))
+
+    def hash_call(self, password):
+        return passwords.scrypt_hash, (password, self.log_n, self.r, self.p)
+
+    def verify_call(self, password, hashed):
+        return passwords.scrypt_verify, (password, hashed.decode('ascii'))
+
+    def needs_update(self, hashed):
+        params, _, _ = passwords.scrypt_params(hashed.decode('ascii'))
+        return params != self.params()
+
+    def params(self):
+        return {'log_n': self.log_n, 'r': self.r, 'p': self.p}
+
+# Registered hashers by scheme name; the default one hashes new passwords
+_HASHER_TYPES = {'bcrypt': _BcryptHasher, 'scrypt': _ScryptHasher}
+_hashers = {'bcrypt': _BcryptHasher(), 'scrypt': _ScryptHasher()}
+_default_hasher = _hashers.get(PASSWORD_SCHEME, _hashers['bcrypt'])
+
+def configure_password_hasher(scheme, **params):
+    """
+    Make scheme the default for new hashes, optionally with new parameters
+    (e.g. configure_password_hasher('bcrypt', rounds=13)). Existing hashes that
+    don't match are upgraded the next time their owner logs in.
+    """
+    global _default_hasher
+    if scheme not in _HASHER_TYPES:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    hasher = _HASHER_TYPES[scheme](**params) if params else _hashers[scheme]
+    _hashers[scheme] = hasher
+    _default_hasher = hasher
+
+def _as_bytes(hashed):
+    return hashed.encode('ascii') if isinstance(hashed, str) else bytes(hashed)
+
+def _identify_hasher(hashed):
+    """Find the registered hasher that produced a stored hash, or None"""
+    for hasher in _hashers.values():
+        if hasher.identify(hashed):
+            return hasher
+    return None
+
+def password_needs_rehash(hashed):
+    """Check whether a stored hash uses a different scheme or parameters than the default"""
+    hashed = _as_bytes(hashed)
+    hasher = _identify_hasher(hashed)
+    if hasher is not _default_hasher:
+        return True
+    try:
+        return hasher.needs_update(hashed)
+    except (ValueError, KeyError):
+        return True
+
+def calibrate_hasher(scheme='bcrypt', target_ms=250, max_ms=None):
+    """
+    Find the strongest parameters whose hash time stays within target_ms on this machine
+    Returns: dict of parameters for configure_password_hasher plus the measured 'ms'
+    """
+    if scheme not in _HASHER_TYPES:
+        raise ValueError(f"Unknown password scheme: {scheme}")
+    max_ms = max_ms or target_ms
+    
+    def measure(hasher):
+        func, args = hasher.hash_call('Calibrate123!')
+        started = time.perf_counter()
+        func(*args)
+        return (time.perf_counter() - started) * 1000
+    
+    # Each step doubles the work, so stop at the last setting under the target
+    if scheme == 'bcrypt':
+        candidates = [{'rounds': rounds} for rounds in range(4, 32)]
+    else:
+        candidates = [{'log_n': log_n, 'r': SCRYPT_R, 'p': SCRYPT_P} for log_n in range(10, 23)]
+    
+    best = None
+    for params in candidates:
+        elapsed = measure(_HASHER_TYPES[scheme](**params))
+        if elapsed > max_ms and best is not None:
+            break
+        best = dict(params, ms=round(elapsed, 1))
+        if elapsed >= target_ms:
+            break
+    return best
+
+@handle_db_operation
+def hash_password(password):
+    """Hash password with the default hasher (raises ServerBusyError when overloaded)"""
+    func, args = _default_hasher.hash_call(password)
+    return _hashing_service.run(func, *args)
+
+@handle_db_operation
+def verify_password(password, hashed):
+    """Verify password against a hash of any registered scheme (raises ServerBusyError when overloaded)"""
+    hashed = _as_bytes(hashed)
+    hasher = _identify_hasher(hashed)
+    if hasher is None:
+        return False
+    func, args = hasher.verify_call(password, hashed)
+    return _hashing_service.run(func, *args)
+
+@handle_db_operation
+def hash_passwords(passwords_to_hash):
+    """Hash many passwords in parallel across the hashing workers"""
+    calls = [_default_hasher.hash_call(password) for password in passwords_to_hash]
+    if not calls:
+        return []
+    return _hashing_service.run_many(calls[0][0], [args for _, args in calls])
+
+def get_hashing_stats():
+    """Get password hashing service counters"""
+    return _hashing_service.stats()
+
+def _validate_new_user(username, email, password, role):
+    """
+    Validate and normalise the fields of a new user
+    Returns: (error message or None, username, email)
+    """
+    # Input validation and sanitization
+    if not all([username, email, password, role]):
+        return "All fields are required", username, email
+    
+    # Trim and validate inputs
+    username = username.strip()
+    email = email.strip().lower()  # Normalize email to lowercase
+    
+    if not all([username, email, password, role]):
+        return "Fields cannot be empty or contain only spaces", username, email
+    
+    if role not in ['admin', 'student']:
+        return "Invalid role specified", username, email
+    
+    if len(password) < 8:
+        return "Password must be at least 8 characters", username, email
+    
+    # Length validation
+    if len(username) > 20:
+        return "Username cannot be longer than 20 characters", username, email
+    
+    if len(email) > 100:
+        return "Email address is too long", username, email
+    
+    # Basic password strength check (more detailed validation in auth.py)
+    if not (any(c.isalpha() for c in password) and any(c.isdigit() for c in password)):
+        return "Password must contain at least one letter and one number", username, email
+    
+    return None, username, email
+
+# Two single-index lookups rather than one OR, so neither half can fall back to a scan
+_NAME_OR_EMAIL_TAKEN_SQL = _register_query('create_user.duplicate_check', """
+    SELECT 1 FROM users WHERE username = ?
+    UNION ALL
+    SELECT 1 FROM users WHERE email = ?
+    LIMIT 1
+""", ('student', 'student@demo.com'))
+
+_INSERT_USER_SQL = """
+    INSERT INTO users (username, email, password_hash, role) 
+    VALUES (?, ?, ?, ?)
+"""
+
+@handle_db_operation
+def create_user(username, email, password, role='student'):
+    """
+    Create new user with validation
+    Returns: (success: bool, message: str)
+    """
+    error, username, email = _validate_new_user(username, email, password, role)
+    if error:
+        return False, error
+    
+    # Hash before queueing the write so the writer never waits on bcrypt
+    try:
+        password_hash = hash_password(password)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    
+    # Consult the membership index here, not in the job: the writer holds SQLite's write lock
+    maybe_taken = _membership_index.might_contain(username, email)
+    
+    def write(cursor):
+        # Check for existing user; a miss in the membership index needs no query
+        if maybe_taken:
+            cursor.execute(_NAME_OR_EMAIL_TAKEN_SQL, (username, email))
+            
+            taken = cursor.fetchone() is not None
+            _membership_index.record_confirmation(taken)
+            if taken:
+                return None
+        
+        # Create user
+        cursor.execute(_INSERT_USER_SQL, (username, email, password_hash, role))
+        return cursor.lastrowid
+    
+    try:
+        user_id = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.IntegrityError:
+        # Another process (or a job earlier in the same batch) took the name since the index last synced
+        return False, "Username or email already exists"
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if user_id is None:
+        return False, "Username or email already exists"
+    
+    _user_cache.invalidate()
+    _membership_index.add(username, email)
+    record_auth_event('user_created', username, user_id, f"role={role}")
+    return True, "User created successfully"
+
+_AVAILABILITY_SQL = {
+    'username': _register_query(
+        'check_availability.username', "SELECT 1 FROM users WHERE username = ?", ('student',)
+    ),
+    'email': _register_query(
+        'check_availability.email', "SELECT 1 FROM users WHERE email = ?", ('student@demo.com',)
+    ),
+}
+
+@handle_db_operation
+def check_availability(username=None, email=None):
+    """
+    Check whether a username and/or email is still free, for live form feedback
+    Returns: dict with 'username' and/or 'email' keys: True if available, False if taken,
+             None if the database could not be reached
+    """
+    fields = {}
+    if username and username.strip():
+        fields['username'] = username.strip()
+    if email and email.strip():
+        fields['email'] = email.strip().lower()  # Stored lowercased
+    
+    availability = {}
+    for field, value in fields.items():
+        try:
+            if not _membership_index.might_contain(**{field: value}):
+                availability[field] = True
+                continue
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_AVAILABILITY_SQL[field], (value,))
+                taken = cursor.fetchone() is not None
+        except sqlite3.Error:
+            availability[field] = None
+            continue
+        _membership_index.record_confirmation(taken)
+        availability[field] = not taken
+    return availability
+
+def _existing_users_sql(username_count, email_count):
+    # UNION of two IN-list lookups, each answered by its own unique index
+    return f"""
+        SELECT username, email FROM users WHERE username IN ({', '.join('?' * username_count)})
+        UNION
+        SELECT username, email FROM users WHERE email IN ({', '.join('?' * email_count)})
+    """
+
+_register_query(
+    'bulk_create_users.existing', _existing_users_sql(2, 2),
+    ('admin', 'student', 'admin@coplur.com', 'student@demo.com')
+)
+
+def _find_existing_users(cursor, usernames, emails):
+    """
+    Look up which of the given usernames and emails are already taken
+    Returns: (taken usernames: set, taken emails: set)
+    """
+    taken_usernames, taken_emails = set(), set()
+    usernames, emails = list(usernames), list(emails)
+    
+    # Chunk to stay well under SQLite's bound-parameter limit
+    for start in range(0, max(len(usernames), len(emails)), BULK_LOOKUP_CHUNK):
+        username_chunk = usernames[start:start + BULK_LOOKUP_CHUNK]
+        email_chunk = emails[start:start + BULK_LOOKUP_CHUNK]
+        cursor.execute(
+            _existing_users_sql(len(username_chunk), len(email_chunk)),
+            (*username_chunk, *email_chunk)
+        )
+        for row in cursor.fetchall():
+            taken_usernames.add(row['username'])
+            taken_emails.add(row['email'])
+    
+    return taken_usernames, taken_emails
+
+@handle_db_operation
+def bulk_create_users(rows):
+    """
+    Create many users in a single transaction
+    rows: iterable of dicts with 'username', 'email', 'password' and optional 'role' (default student)
+    Rows with a None key (extra CSV fields) are rejected
+    Returns: (created: int, errors: list of dicts with 'row', 'username' and 'error')
+    """
+    errors = []
+    candidates = []  # (row number, username, email, password, role)
+    seen_usernames, seen_emails = set(), set()
+    
+    # Validate with the same rules as create_user, streaming over the input
+    for row_number, row in enumerate(rows, start=1):
+        role = (row.get('role') or 'student').strip().lower()
+        password = row.get('password') or ''
+        error, username, email = _validate_new_user(
+            row.get('username'), row.get('email'), password, role
+        )
+        if None in row:
+            # csv.DictReader collects fields beyond the header under None
+            error = "Row has more columns than the header"
+        elif not error and (username in seen_usernames or email in seen_emails):
+            error = "Duplicate username or email within the import"
+        if error:
+            errors.append({'row': row_number, 'username': username, 'error': error})
+            continue
+        
+        seen_usernames.add(username)
+        seen_emails.add(email)
+        candidates.append((row_number, username, email, password, role))
+    
+    def drop_existing(cursor, pending):
+        """Returns: (candidates still free, errors for the taken ones)"""
+        taken_usernames, taken_emails = _find_existing_users(
+            cursor, [c[1] for c in pending], [c[2] for c in pending]
+        )
+        remaining, rejected = [], []
+        for candidate in pending:
+            if candidate[1] in taken_usernames or candidate[2] in taken_emails:
+                rejected.append({
+                    'row': candidate[0],
+                    'username': candidate[1],
+                    'error': "Username or email already exists",
+                })
+            else:
+                remaining.append(candidate)
+        return remaining, rejected
+    
+    try:
+        # Skip hashing for users that already exist
+        if candidates:
+            with get_db_connection() as conn:
+                candidates, rejected = drop_existing(conn.cursor(), candidates)
+            errors.extend(rejected)
+        
+        if not candidates:
+            return 0, sorted(errors, key=lambda e: e['row'])
+        
+        # Hash before queueing the write so the writer never waits on bcrypt
+        password_hashes = hash_passwords([c[3] for c in candidates])
+        hashed = {c[0]: h for c, h in zip(candidates, password_hashes)}
+        
+        def write(cursor):
+            # Re-check inside the transaction in case users were added while hashing
+            remaining, rejected = drop_existing(cursor, candidates)
+            cursor.executemany(_INSERT_USER_SQL, [(c[1], c[2], hashed[c[0]], c[4]) for c in remaining])
+            return remaining, rejected
+        
+        candidates, rejected = _write_queue.run(write)
+        errors.extend(rejected)
+        _user_cache.invalidate()
+        for c in candidates:
+            _membership_index.add(c[1], c[2])
+        if candidates:
+            # One event per import, so a large file can't flood the event queue
+            record_auth_event('users_imported', detail=f"created={len(candidates)} rejected={len(errors)}")
+        
+    except ServerBusyError:
+        errors.append({'row': None, 'username': None, 'error': SERVER_BUSY_MESSAGE})
+        return 0, errors
+    except sqlite3.Error as e:
+        errors.append({'row': None, 'username': None, 'error': f"Database error: {str(e)}"})
+        return 0, errors
+    
+    return len(candidates), sorted(errors, key=lambda e: e['row'])
+
+_LOGIN_USER_SQL = _register_query('authenticate_user', """
+    SELECT id, username, email, password_hash, role, session_version 
+    FROM users WHERE username = ?
+""", ('student',))
+_REPLACE_HASH_SQL = _register_query('replace_password_hash', """
+    UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?
+""", ('hash', 2, 'old hash'))
+
+@handle_db_operation
+def authenticate_user(username, password):
+    """
+    Authenticate user login
+    Returns: user dict if successful, None if failed
+    Raises: ServerBusyError if the hashing service is at capacity
+    """
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_LOGIN_USER_SQL, (username,))
+            
+            user = cursor.fetchone()
+            
+    except sqlite3.Error:
+        return None
+    
+    # Verify after the connection is back in the pool
+    if user and verify_password(password, user['password_hash']):
+        if password_needs_rehash(user['password_hash']):
+            _upgrade_password_hash(user['id'], user['password_hash'], password)
+        record_auth_event('login_success', user['username'], user['id'])
+        return {
+            'id': user['id'],
+            'username': user['username'],
+            'email': user['email'],
+            'role': user['role'],
+            'session_version': user['session_version']
+        }
+    record_auth_event('login_failure', username, user['id'] if user else None,
+                      None if user else "unknown username")
+    return None
+
+def _upgrade_password_hash(user_id, old_hash, password):
+    """Re-hash a just-verified password with the current default hasher"""
+    try:
+        new_hash = hash_password(password)
+    except ServerBusyError:
+        return  # Try again on a later login rather than delaying this one
+    
+    def write(cursor):
+        # Only replace the hash we verified, in case the password changed meanwhile
+        cursor.execute(_REPLACE_HASH_SQL, (new_hash, user_id, old_hash))
+    
+    # Don't wait for the commit; a lost upgrade is retried on a later login
+    try:
+        _write_queue.submit(write)
+    except ServerBusyError:
+        pass
+
+# Reads the whole table by design; the paged admin views use list_users instead
+_ALL_USERS_SQL = _register_query('get_all_users', """
+    SELECT id, username, email, role, created_at 
+    FROM users ORDER BY created_at DESC, id DESC
+""", hot=False)
+
+def _load_all_users():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(_ALL_USERS_SQL)
+        
+        return [dict(row) for row in cursor.fetchall()]
+
+@handle_db_operation
+def get_all_users():
+    """Get all users for admin dashboard"""
+    try:
+        return _user_cache.get_or_load(('all_users',), _load_all_users)
+            
+    except sqlite3.Error:
+        return []
+
+def _encode_cursor(sort, row):
+    """Encode the position after row as an opaque page cursor"""
+    column, _ = USER_LIST_SORTS[sort]
+    position = [sort, row[column], row['id']]
+    return base64.urlsafe_b64encode(json.dumps(position).encode('utf-8')).decode('ascii')
+
+def _decode_cursor(cursor, sort):
+    """Decode a page cursor, returning None if it is missing, invalid or for another sort"""
+    if not cursor:
+        return None
+    try:
+        cursor_sort, key, user_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        return None
+    if cursor_sort != sort:
+        return None
+    return key, user_id
+
+def _list_users_sql(sort, role_filtered, after_cursor):
+    """Build the page query; parameters are (role?, cursor position..., limit)"""
+    column, direction = USER_LIST_SORTS[sort]
+    conditions = []
+    
+    if role_filtered:
+        conditions.append("role = ?")
+    
+    # Seek past the last row of the previous page instead of using OFFSET
+    if after_cursor:
+        operator = '<' if direction == 'DESC' else '>'
+        if column == 'username':
+            # Usernames are unique, so they are a complete key on their own
+            conditions.append(f"username {operator} ?")
+        else:
+            conditions.append(f"(created_at, id) {operator} (?, ?)")
+    
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order_clause = f"{column} {direction}"
+    if column != 'username':
+        order_clause += f", id {direction}"
+    
+    return f"""
+        SELECT id, username, email, role, created_at 
+        FROM users {where_clause} 
+        ORDER BY {order_clause} LIMIT ?
+    """
+
+def _register_list_users_queries():
+    """Register every sort, role filter and cursor combination of the page query"""
+    for sort, (column, _) in USER_LIST_SORTS.items():
+        position = ('student',) if column == 'username' else ('2025-01-01 00:00:00', 1000)
+        for role_filtered in (False, True):
+            for after_cursor in (False, True):
+                name = f"list_users.{sort}" + ('.role' if role_filtered else '') + \
+                       ('.after_cursor' if after_cursor else '')
+                params = ('student',) * role_filtered + position * after_cursor + (DEFAULT_PAGE_SIZE + 1,)
+                _register_query(name, _list_users_sql(sort, role_filtered, after_cursor), params, bounded=True)
+
+_register_list_users_queries()
+
+@handle_db_operation
+def list_users(cursor=None, limit=DEFAULT_PAGE_SIZE, sort='newest', role_filter=None):
+    """
+    Get one page of users using keyset pagination
+    Returns: dict with 'users' (list of user dicts) and 'next_cursor' (str, or None on the last page)
+    """
+    if sort not in USER_LIST_SORTS:
+        sort = 'newest'
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    column, _ = USER_LIST_SORTS[sort]
+    
+    if role_filter is not None and role_filter not in ['admin', 'student']:
+        return {'users': [], 'next_cursor': None}
+    
+    params = []
+    if role_filter:
+        params.append(role_filter)
+    
+    position = _decode_cursor(cursor, sort)
+    if position is not None:
+        params.extend(position[:1] if column == 'username' else position)
+    
+    sql = _list_users_sql(sort, bool(role_filter), position is not None)
+    
+    def load_page():
+        with get_db_connection() as conn:
+            cursor_obj = conn.cursor()
+            # Fetch one extra row to learn whether another page exists
+            cursor_obj.execute(sql, (*params, limit + 1))
+            
+            rows = [dict(row) for row in cursor_obj.fetchall()]
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(sort, rows[-1])
+        
+        return {'users': rows, 'next_cursor': next_cursor}
+    
+    try:
+        return _user_cache.get_or_load(
+            ('list_users', cursor, limit, sort, role_filter), load_page
+        )
+            
+    except sqlite3.Error:
+        return {'users': [], 'next_cursor': None}
+
+def _search_users_sql(stage, role_filtered):
+    """Build one search stage ('username_prefix', 'email_prefix', 'substring' or 'fuzzy'); role comes before the limit"""
+    role_clause = " AND u.role = ?" if role_filtered else ""
+    if stage in ('substring', 'fuzzy'):
+        # Substring hits are read in rowid order so the LIMIT stops the index walk early;
+        # ranking them all by bm25 would touch every match of a common term like "gmail".
+        # CROSS JOIN keeps the index outermost, or a role filter walks every user of that role
+        order_clause = "ORDER BY users_fts.rank " if stage == 'fuzzy' else ""
+        return f"""
+            SELECT u.id, u.username, u.email, u.role, u.created_at 
+            FROM users_fts CROSS JOIN users u ON u.id = users_fts.rowid 
+            WHERE users_fts MATCH ?{role_clause} 
+            {order_clause}LIMIT ?
+        """
+    column = stage.split('_')[0]
+    if role_filtered and column == 'email':
+        # No (role, email) index; "+" stops SQLite picking the role index and sorting its matches
+        role_clause = " AND +u.role = ?"
+    # A range on the column's unique index rather than LIKE, which SQLite can't use it for
+    return f"""
+        SELECT u.id, u.username, u.email, u.role, u.created_at 
+        FROM users u 
+        WHERE u.{column} >= ? AND u.{column} < ?{role_clause} 
+        ORDER BY u.{column} LIMIT ?
+    """
+
+def _register_search_users_queries():
+    """Register every search stage with and without a role filter"""
+    samples = {
+        'username_prefix': ('stu', 'stu\U0010ffff'),
+        'email_prefix': ('stu', 'stu\U0010ffff'),
+        'substring': ('"student"',),
+        'fuzzy': ('"stud" OR "tude" OR "uden" OR "dent"',),
+    }
+    for stage, params in samples.items():
+        for role_filtered in (False, True):
+            name = f"search_users.{stage}" + ('.role' if role_filtered else '')
+            params_with_limit = params + ('student',) * role_filtered + (DEFAULT_PAGE_SIZE,)
+            _register_query(name, _search_users_sql(stage, role_filtered), params_with_limit)
+
+_register_search_users_queries()
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections"""
-    conn = sqlite3.connect(DATABASE_FILE)
-    conn.row_factory = sqlite3.Row  # Enable column access by name
+def _substring_rank(user, query):
+    """Sort key for substring hits: username hits first, then earlier and tighter matches"""
+    position = user['username'].lower().find(query)
+    if position < 0:
+        return (1, user['email'].find(query), len(user['email']))
+    return (0, position, len(user['username']))
+
+@handle_db_operation
+def search_users(query, role_filter=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Find users by username or email, best matches first
+    Usernames starting with the query come first, then matches anywhere in the
+    username or email. Only when nothing matches exactly are close spellings
+    returned, ranked by how many pieces of the query they contain.
+    Returns: list of user dicts, each with 'match' set to 'prefix', 'substring' or 'fuzzy'
+    """
+    query = (query or '').strip()
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if not query or (role_filter is not None and role_filter not in ['admin', 'student']):
+        return []
+    role_params = (role_filter,) if role_filter else ()
+    folded = query.lower()  # The trigram index and stored emails are case-insensitive/lowercase
+    
+    def run_search():
+        results = {}
+        
+        def fetch(conn, stage, params, fetch_limit):
+            sql = _search_users_sql(stage, bool(role_filter))
+            return [dict(row) for row in conn.execute(sql, (*params, *role_params, fetch_limit))]
+        
+        def collect(users, match):
+            for user in users:
+                if len(results) >= limit:
+                    break
+                results.setdefault(user['id'], dict(user, match=match))
+        
+        with get_db_connection() as conn:
+            collect(fetch(conn, 'username_prefix', (query, query + '\U0010ffff'), limit), 'prefix')
+            
+            indexed = len(query) >= SEARCH_MIN_SUBSTRING
+            if indexed and len(results) < limit:
+                try:
+                    # Over-fetch so the best of the first hits can be picked
+                    hits = fetch(conn, 'substring', (_fts_phrase(query),), limit * 4)
+                    collect(sorted(hits, key=lambda user: _substring_rank(user, folded)), 'substring')
+                    
+                    if not results and len(query) > SEARCH_MIN_SUBSTRING:
+                        # One typo leaves about half the query intact, so match any
+                        # window of that length; more matching windows rank higher
+                        size = max(SEARCH_MIN_SUBSTRING, len(folded) // 2)
+                        windows = sorted({folded[i:i + size] for i in range(len(folded) - size + 1)})
+                        collect(fetch(conn, 'fuzzy', (' OR '.join(map(_fts_phrase, windows)),), limit), 'fuzzy')
+                except sqlite3.OperationalError:
+                    indexed = False  # No users_fts in this SQLite build, see _migrate_user_search
+            
+            if not indexed and len(results) < limit:
+                # Too short for trigrams, or no index: email prefixes as well
+                collect(fetch(conn, 'email_prefix', (folded, folded + '\U0010ffff'), limit), 'prefix')
+        
+        return list(results.values())
+    
     try:
-        yield conn
-    finally:
-        conn.close()
+        return _user_cache.get_or_load(('search_users', query, role_filter, limit), run_search)
+            
+    except sqlite3.Error:
+        return []
 
-def handle_db_operation(operation_func):
-    """Decorator to handle database operations with error handling"""
-    def wrapper(*args, **kwargs):
-        try:
-            return operation_func(*args, **kwargs)
-        except sqlite3.Error as e:
-            return False, f"Database error: {str(e)}"
-    return wrapper
+_ROLE_COUNTS_SQL = _register_query('get_role_counts', "SELECT role, user_count FROM role_counts")
+_ADMIN_COUNT_SQL = _register_query('admin_count', "SELECT user_count FROM role_counts WHERE role = 'admin'")
 
-def init_database():
-    """Initialize database with users table and default admin and student"""
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
+@handle_db_operation
+def get_role_counts():
+    """
+    Get the number of users per role from the trigger-maintained counters
+    Returns: dict with 'admin', 'student' and 'total' counts
+    """
+    def load_counts():
+        counts = {'admin': 0, 'student': 0}
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_ROLE_COUNTS_SQL)
+            counts.update({row['role']: row['user_count'] for row in cursor.fetchall()})
         
-        # Create users table with proper constraints
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                role TEXT NOT NULL CHECK (role IN ('admin', 'student')),
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create default admin if none exists
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-        admin_count = cursor.fetchone()[0]
-        
-        if admin_count == 0:
-            # Updated admin password to meet new requirements
-            admin_password = hash_password('Admin123!')
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, role) 
-                VALUES (?, ?, ?, ?)
-            """, ('admin', 'admin@coplur.com', admin_password, 'admin'))
-        
-        # Create default student for demo purposes if none exists
-        cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'student'")
-        student_count = cursor.fetchone()[0]
-        
-        if student_count == 0:
-            student_password = hash_password('Student123!')
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, role) 
-                VALUES (?, ?, ?, ?)
-            """, ('student', 'student@demo.com', student_password, 'student'))
+        counts['total'] = counts['admin'] + counts['student']
+        return counts
+    
+    try:
+        return _user_cache.get_or_load(('role_counts',), load_counts)
             
-        conn.commit()
+    except sqlite3.Error:
+        return {'admin': 0, 'student': 0, 'total': 0}
 
-def hash_password(password):
-    """Hash password using bcrypt"""
-    salt = bcrypt.gensalt()
-    return bcrypt.hashpw(password.encode('utf-8'), salt)
+def _iter_users_sql(role_filtered, has_from, has_to):
+    """Build the export query; parameters are (role?, created_from?, created_to?)"""
+    conditions = []
+    if role_filtered:
+        conditions.append("role = ?")
+    if has_from:
+        conditions.append("created_at >= ?")
+    if has_to:
+        conditions.append("created_at < date(?, '+1 day')")
+    
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Ordered to match the created_at indexes so SQLite never sorts in memory
+    return f"""
+        SELECT id, username, email, role, created_at 
+        FROM users {where_clause} 
+        ORDER BY created_at, id
+    """
 
-def verify_password(password, hashed):
-    """Verify password against hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+def _register_iter_users_queries():
+    """Register every filter combination of the export query; exports stream, so none are hot"""
+    for role_filtered in (False, True):
+        for has_from in (False, True):
+            for has_to in (False, True):
+                name = 'iter_users' + ('.role' if role_filtered else '') + \
+                       ('.from' if has_from else '') + ('.to' if has_to else '')
+                params = ('student',) * role_filtered + ('2025-01-01',) * has_from + ('2025-01-31',) * has_to
+                _register_query(name, _iter_users_sql(role_filtered, has_from, has_to), params, hot=False)
 
-def create_user(username, email, password, role='student'):
+_register_iter_users_queries()
+
+@handle_db_operation
+def iter_users(role_filter=None, created_from=None, created_to=None, chunk_size=EXPORT_CHUNK_SIZE):
     """
-    Create new user with validation
-    Returns: (success: bool, message: str)
+    Stream users in creation order without loading the whole table
+    created_from/created_to: optional inclusive dates (date objects or 'YYYY-MM-DD')
+    Yields: user dicts
     """
-    # Input validation and sanitization
-    if not all([username, email, password, role]):
-        return False, "All fields are required"
+    params = []
+    if role_filter:
+        params.append(role_filter)
+    if created_from:
+        params.append(str(created_from))
+    if created_to:
+        params.append(str(created_to))
     
-    # Trim and validate inputs
-    username = username.strip()
-    email = email.strip().lower()  # Normalize email to lowercase
-    
-    if not all([username, email, password, role]):
-        return False, "Fields cannot be empty or contain only spaces"
+    sql = _iter_users_sql(bool(role_filter), bool(created_from), bool(created_to))
     
-    if role not in ['admin', 'student']:
-        return False, "Invalid role specified"
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            for row in rows:
+                yield dict(row)
+
+@handle_db_operation
+def export_users(export_format='csv', role_filter=None, created_from=None, created_to=None,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Stream users as CSV or JSONL text
+    Yields: str chunks of roughly chunk_size rows each
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {export_format}")
     
-    if len(password) < 8:
-        return False, "Password must be at least 8 characters"
+    buffer = io.StringIO()
+    writer = None
+    if export_format == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
     
-    # Length validation
-    if len(username) > 20:
-        return False, "Username cannot be longer than 20 characters"
+    pending = 0
+    for user in iter_users(role_filter, created_from, created_to, chunk_size):
+        if writer:
+            writer.writerow(user)
+        else:
+            buffer.write(json.dumps(user) + '\n')
+        pending += 1
+        
+        if pending >= chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
     
-    if len(email) > 100:
-        return False, "Email address is too long"
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _normalize_user_ids(user_ids):
+    """Deduplicate user IDs, returning None if any of them is invalid"""
+    ids = set()
+    for user_id in user_ids:
+        if not isinstance(user_id, int) or isinstance(user_id, bool) or user_id <= 0:
+            return None
+        ids.add(user_id)
+    return sorted(ids)
+
+def _roles_by_id_sql(count):
+    return f"SELECT id, role FROM users WHERE id IN ({', '.join('?' * count)})"
+
+_register_query('fetch_roles', _roles_by_id_sql(3), (1, 2, 3))
+
+def _fetch_roles(cursor, user_ids):
+    """Get {id: role} for the given user IDs"""
+    roles = {}
+    for start in range(0, len(user_ids), BULK_LOOKUP_CHUNK):
+        chunk = user_ids[start:start + BULK_LOOKUP_CHUNK]
+        cursor.execute(_roles_by_id_sql(len(chunk)), chunk)
+        roles.update({row['id']: row['role'] for row in cursor.fetchall()})
+    return roles
+
+_DELETE_USER_SQL = _register_query('delete_user', "DELETE FROM users WHERE id = ?", (2,))
+# Role changes revoke the user's session tokens, which carry the old role
+_SET_ROLE_SQL = _register_query(
+    'set_role', "UPDATE users SET role = ?, session_version = session_version + 1 WHERE id = ?", ('student', 2)
+)
+
+@handle_db_operation
+def bulk_delete_users(user_ids):
+    """
+    Delete several users in one transaction with admin protection
+    Returns: (success: bool, message: str)
+    """
+    user_ids = _normalize_user_ids(user_ids)
+    if user_ids is None:
+        return False, "Invalid user ID"
+    if not user_ids:
+        return False, "No users selected"
     
-    # Basic password strength check (more detailed validation in auth.py)
-    if not (any(c.isalpha() for c in password) and any(c.isdigit() for c in password)):
-        return False, "Password must contain at least one letter and one number"
+    def write(cursor):
+        roles = _fetch_roles(cursor, user_ids)
+        if not roles:
+            return False, "User not found", roles
+        
+        # Check the last-admin invariant once for the whole batch
+        admins_selected = sum(1 for role in roles.values() if role == 'admin')
+        if admins_selected:
+            cursor.execute(_ADMIN_COUNT_SQL)
+            admin_count = cursor.fetchone()[0]
+            
+            if admin_count - admins_selected < 1:
+                return False, "Cannot delete the last admin user", roles
+        
+        cursor.executemany(_DELETE_USER_SQL, [(user_id,) for user_id in roles])
+        return True, None, roles
     
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Check for existing user
-            cursor.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE username = ? OR email = ?
-            """, (username, email))
-            
-            if cursor.fetchone()[0] > 0:
-                return False, "Username or email already exists"
-            
-            # Create user
-            password_hash = hash_password(password)
-            cursor.execute("""
-                INSERT INTO users (username, email, password_hash, role) 
-                VALUES (?, ?, ?, ?)
-            """, (username, email, password_hash, role))
-            
-            conn.commit()
-            return True, "User created successfully"
-            
+        success, message, roles = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
     except sqlite3.Error as e:
         return False, f"Database error: {str(e)}"
+    
+    if not success:
+        return False, message
+    
+    _user_cache.invalidate()
+    _membership_index.note_removed(len(roles))
+    for user_id, role in roles.items():
+        record_auth_event('user_deleted', user_id=user_id, detail=f"role={role}")
+    
+    message = f"Deleted {len(roles)} user(s)"
+    if len(roles) < len(user_ids):
+        message += f" ({len(user_ids) - len(roles)} not found)"
+    return True, message
 
-def authenticate_user(username, password):
+@handle_db_operation
+def bulk_update_roles(user_ids, role):
     """
-    Authenticate user login
-    Returns: user dict if successful, None if failed
+    Set the role of several users in one transaction with admin protection
+    Returns: (success: bool, message: str)
     """
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, username, email, password_hash, role 
-                FROM users WHERE username = ?
-            """, (username,))
-            
-            user = cursor.fetchone()
-            if user and verify_password(password, user['password_hash']):
-                return {
-                    'id': user['id'],
-                    'username': user['username'],
-                    'email': user['email'],
-                    'role': user['role']
-                }
-            return None
+    if role not in ['admin', 'student']:
+        return False, "Invalid role specified"
+    
+    user_ids = _normalize_user_ids(user_ids)
+    if user_ids is None:
+        return False, "Invalid user ID"
+    if not user_ids:
+        return False, "No users selected"
+    
+    def write(cursor):
+        roles = _fetch_roles(cursor, user_ids)
+        if not roles:
+            return False, "User not found", roles, []
+        
+        changed = [user_id for user_id, current_role in roles.items() if current_role != role]
+        
+        # Demoting admins must leave at least one behind
+        if role != 'admin' and changed:
+            cursor.execute(_ADMIN_COUNT_SQL)
+            admin_count = cursor.fetchone()[0]
             
-    except sqlite3.Error:
-        return None
-
-def get_all_users():
-    """Get all users for admin dashboard"""
+            if admin_count - len(changed) < 1:
+                return False, "Cannot change role: This would remove the last admin user", roles, []
+        
+        cursor.executemany(_SET_ROLE_SQL, [(role, user_id) for user_id in changed])
+        return True, None, roles, changed
+    
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, username, email, role, created_at 
-                FROM users ORDER BY created_at DESC
-            """)
-            
-            return [dict(row) for row in cursor.fetchall()]
-            
-    except sqlite3.Error:
-        return []
+        success, message, roles, changed = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if not success:
+        return False, message
+    
+    _user_cache.invalidate()
+    for user_id in changed:
+        record_auth_event('user_updated', user_id=user_id, detail=f"role: {roles[user_id]} -> {role}")
+    
+    message = f"Updated role for {len(changed)} user(s)"
+    if len(roles) < len(user_ids):
+        message += f" ({len(user_ids) - len(roles)} not found)"
+    return True, message
+
+_ACCOUNT_BY_ID_SQL = _register_query('account_by_id', "SELECT username, email, role FROM users WHERE id = ?", (2,))
 
+@handle_db_operation
 def delete_user(user_id):
     """
     Delete user by ID with admin protection
     Returns: (success: bool, message: str)
     """
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get user info
-            cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                return False, "User not found"
-            
-            # Prevent deletion of last admin
-            if user['role'] == 'admin':
-                cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-                admin_count = cursor.fetchone()[0]
-                
-                if admin_count <= 1:
-                    return False, "Cannot delete the last admin user"
-            
-            # Delete user
-            cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-            conn.commit()
-            
-            return True, "User deleted successfully"
+    def write(cursor):
+        # Get user info
+        cursor.execute(_ACCOUNT_BY_ID_SQL, (user_id,))
+        user = cursor.fetchone()
+        
+        if not user:
+            return False, "User not found", None
+        
+        # Prevent deletion of last admin
+        if user['role'] == 'admin':
+            cursor.execute(_ADMIN_COUNT_SQL)
+            admin_count = cursor.fetchone()[0]
             
+            if admin_count <= 1:
+                return False, "Cannot delete the last admin user", None
+        
+        # Delete user
+        cursor.execute(_DELETE_USER_SQL, (user_id,))
+        return True, "User deleted successfully", dict(user)
+    
+    try:
+        success, message, user = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
     except sqlite3.Error as e:
         return False, f"Database error: {str(e)}"
+    
+    if success:
+        _user_cache.invalidate()
+        _membership_index.note_removed()
+        record_auth_event('user_deleted', user['username'], user_id, f"role={user['role']}")
+    return success, message
 
+# A new password revokes every session token issued to the user
+_SET_PASSWORD_SQL = _register_query('update_password', """
+    UPDATE users SET password_hash = ?, session_version = session_version + 1 WHERE username = ?
+""", ('hash', 'student'))
+_CHANGE_PASSWORD_SQL = _register_query('change_password', """
+    UPDATE users SET password_hash = ?, session_version = session_version + 1
+    WHERE id = ? AND password_hash = ?
+""", ('hash', 2, 'old hash'))
+_HASH_BY_ID_SQL = _register_query('password_hash_by_id', "SELECT password_hash FROM users WHERE id = ?", (2,))
+
+@handle_db_operation
 def update_password(username, new_password):
     """Update user password"""
     if len(new_password) < 8:
         return False, "Password must be at least 8 characters"
     
+    try:
+        password_hash = hash_password(new_password)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    
+    def write(cursor):
+        cursor.execute(_SET_PASSWORD_SQL, (password_hash, username))
+        return cursor.rowcount > 0
+    
+    try:
+        updated = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if not updated:
+        return False, "User not found"
+    
+    _user_cache.invalidate()
+    record_auth_event('password_reset', username)
+    return True, "Password updated successfully"
+
+@handle_db_operation
+def change_password(user_id, current_password, new_password):
+    """
+    Verify the current password and replace it, keyed by user ID
+    Returns: (success: bool, message: str)
+    """
+    if not isinstance(user_id, int) or user_id <= 0:
+        return False, "Invalid user ID"
+    
+    if len(new_password) < 8:
+        return False, "Password must be at least 8 characters"
+    
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
+            cursor.execute(_HASH_BY_ID_SQL, (user_id,))
+            user = cursor.fetchone()
             
-            password_hash = hash_password(new_password)
-            cursor.execute("""
-                UPDATE users SET password_hash = ? WHERE username = ?
-            """, (password_hash, username))
-            
-            if cursor.rowcount > 0:
-                conn.commit()
-                return True, "Password updated successfully"
-            else:
-                return False, "User not found"
-                
     except sqlite3.Error as e:
         return False, f"Database error: {str(e)}"
+    
+    if not user:
+        return False, "User not found"
+    
+    # Both bcrypt calls run with no connection checked out and no lock held
+    try:
+        if not verify_password(current_password, user['password_hash']):
+            return False, "Current password is incorrect"
+        password_hash = hash_password(new_password)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    
+    def write(cursor):
+        # Replace only the hash that was just verified, so a concurrent
+        # change can't be silently overwritten
+        cursor.execute(_CHANGE_PASSWORD_SQL, (password_hash, user_id, user['password_hash']))
+        return cursor.rowcount > 0
+    
+    try:
+        replaced = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if not replaced:
+        return False, "Password was changed in another session, please try again"
+    
+    _user_cache.invalidate()
+    record_auth_event('password_changed', user_id=user_id)
+    return True, "Password updated successfully"
 
-def update_user(user_id, username, email, role):
+_REVOKE_SESSIONS_SQL = _register_query(
+    'revoke_sessions', "UPDATE users SET session_version = session_version + 1 WHERE id = ?", (2,)
+)
+
+@handle_db_operation
+def revoke_sessions(user_id):
     """
-    Update user information with comprehensive validation
+    Invalidate every session token issued to a user so far, e.g. on logout
     Returns: (success: bool, message: str)
     """
+    if not isinstance(user_id, int) or user_id <= 0:
+        return False, "Invalid user ID"
+    
+    def write(cursor):
+        cursor.execute(_REVOKE_SESSIONS_SQL, (user_id,))
+        return cursor.rowcount > 0
+    
+    try:
+        revoked = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if not revoked:
+        return False, "User not found"
+    
+    _user_cache.invalidate()
+    record_auth_event('logout', user_id=user_id)
+    return True, "Sessions revoked"
+
+_NAME_OR_EMAIL_TAKEN_BY_OTHER_SQL = _register_query('update_user.duplicate_check', """
+    SELECT 1 FROM users WHERE username = ? AND id != ?
+    UNION ALL
+    SELECT 1 FROM users WHERE email = ? AND id != ?
+    LIMIT 1
+""", ('student', 1, 'student@demo.com', 1))
+
+def _validate_user_update(username, email, role):
+    """
+    Validate and normalise the editable fields of an existing user
+    Returns: (error message or None, username, email)
+    """
     # Input validation and sanitization
     if not all([username, email, role]):
-        return False, "All fields are required"
+        return "All fields are required", username, email
     
     # Trim and validate inputs
     username = username.strip()
     email = email.strip().lower()  # Normalize email to lowercase
     
     if not all([username, email, role]):
-        return False, "Fields cannot be empty or contain only spaces"
+        return "Fields cannot be empty or contain only spaces", username, email
     
     if role not in ['admin', 'student']:
-        return False, "Invalid role specified"
+        return "Invalid role specified", username, email
     
     # Length validation
     if len(username) > 20:
-        return False, "Username cannot be longer than 20 characters"
+        return "Username cannot be longer than 20 characters", username, email
     
     if len(email) > 100:
-        return False, "Email address is too long"
+        return "Email address is too long", username, email
+    
+    return None, username, email
+
+# SET expressions see the old row, so session_version only moves when the role changes
+_UPDATE_USER_SQL = _register_query('update_user', """
+    UPDATE users SET username = ?, email = ?, role = ?, session_version = session_version + (role != ?)
+    WHERE id = ?
+""", ('student', 'student@demo.com', 'student', 'student', 2))
+
+@handle_db_operation
+def update_user(user_id, username, email, role):
+    """
+    Update user information with comprehensive validation
+    Returns: (success: bool, message: str)
+    """
+    error, username, email = _validate_user_update(username, email, role)
+    if error:
+        return False, error
     
     # Validate user_id
     if not isinstance(user_id, int) or user_id <= 0:
         return False, "Invalid user ID"
     
-    try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Check if user exists and get current role
-            cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-            current_user = cursor.fetchone()
-            if not current_user:
-                return False, "User not found"
-            
-            current_role = current_user['role']
-            
-            # Prevent removing admin role if it would leave no admins
-            if current_role == 'admin' and role != 'admin':
-                cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'admin'")
-                admin_count = cursor.fetchone()[0]
-                
-                if admin_count <= 1:
-                    return False, "Cannot change role: This is the last admin user in the system"
-            
-            # Check for duplicate username/email (excluding current user)
-            cursor.execute("""
-                SELECT COUNT(*) FROM users 
-                WHERE (username = ? OR email = ?) AND id != ?
-            """, (username, email, user_id))
-            
-            if cursor.fetchone()[0] > 0:
-                return False, "Username or email already exists"
-            
-            # Update user
-            cursor.execute("""
-                UPDATE users SET username = ?, email = ?, role = ? 
-                WHERE id = ?
-            """, (username, email, role, user_id))
-            
-            conn.commit()
-            return True, "User updated successfully"
+    def write(cursor):
+        # Check if user exists and get current role
+        cursor.execute(_ACCOUNT_BY_ID_SQL, (user_id,))
+        current_user = cursor.fetchone()
+        if not current_user:
+            return False, "User not found", None
+        
+        current_role = current_user['role']
+        
+        # Prevent removing admin role if it would leave no admins
+        if current_role == 'admin' and role != 'admin':
+            cursor.execute(_ADMIN_COUNT_SQL)
+            admin_count = cursor.fetchone()[0]
             
+            if admin_count <= 1:
+                return False, "Cannot change role: This is the last admin user in the system", None
+        
+        # Check for duplicate username/email (excluding current user)
+        cursor.execute(_NAME_OR_EMAIL_TAKEN_BY_OTHER_SQL, (username, user_id, email, user_id))
+        
+        if cursor.fetchone() is not None:
+            return False, "Username or email already exists", None
+        
+        # Update user
+        cursor.execute(_UPDATE_USER_SQL, (username, email, role, role, user_id))
+        return True, "User updated successfully", dict(current_user)
+    
+    try:
+        success, message, current_user = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.Error as e:
+        return False, f"Database error: {str(e)}"
+    
+    if success:
+        _user_cache.invalidate()
+        # The previous username/email may be freed; they stay in the filters until a rebuild
+        _membership_index.add(username, email)
+        _membership_index.note_removed()
+        changes = [
+            f"{field}: {current_user[field]} -> {value}"
+            for field, value in (('username', username), ('email', email), ('role', role))
+            if current_user[field] != value
+        ]
+        record_auth_event('user_updated', username, user_id, '; '.join(changes) or None)
+    return success, message
+
+def _accounts_by_id_sql(count):
+    return f"SELECT id, username, email, role FROM users WHERE id IN ({', '.join('?' * count)})"
+
+_register_query('bulk_update_users.accounts', _accounts_by_id_sql(3), (1, 2, 3))
+
+@handle_db_operation
+def bulk_update_users(updates):
+    """
+    Apply edits to several users in one transaction with admin protection
+    updates maps user ID to a dict with 'username', 'email' and 'role'; either
+    every edit is applied or none is.
+    Returns: (success: bool, message: str)
+    """
+    user_ids = _normalize_user_ids(updates)
+    if user_ids is None:
+        return False, "Invalid user ID"
+    if not user_ids:
+        return False, "No changes to save"
+    
+    rows = {}
+    for user_id in user_ids:
+        fields = updates[user_id]
+        error, username, email = _validate_user_update(fields.get('username'), fields.get('email'), fields.get('role'))
+        if error:
+            return False, f"User {user_id}: {error}"
+        rows[user_id] = {'username': username, 'email': email, 'role': fields['role']}
+    
+    # Catch clashes inside the batch before the database reports the first one
+    for field in ('username', 'email'):
+        values = [row[field] for row in rows.values()]
+        if len(set(values)) < len(values):
+            return False, f"The same {field} is used for more than one user"
+    
+    def write(cursor):
+        current = {}
+        for start in range(0, len(user_ids), BULK_LOOKUP_CHUNK):
+            chunk = user_ids[start:start + BULK_LOOKUP_CHUNK]
+            cursor.execute(_accounts_by_id_sql(len(chunk)), chunk)
+            current.update({row['id']: dict(row) for row in cursor.fetchall()})
+        if len(current) < len(user_ids):
+            return False, "User not found", current, {}
+        
+        changed = {user_id: row for user_id, row in rows.items() if row != {
+            field: current[user_id][field] for field in ('username', 'email', 'role')
+        }}
+        if not changed:
+            return True, "No changes to save", current, changed
+        
+        # The batch as a whole must leave at least one admin
+        admin_delta = sum(
+            (row['role'] == 'admin') - (current[user_id]['role'] == 'admin')
+            for user_id, row in changed.items()
+        )
+        if admin_delta < 0:
+            cursor.execute(_ADMIN_COUNT_SQL)
+            if cursor.fetchone()[0] + admin_delta < 1:
+                return False, "Cannot change role: This would remove the last admin user", current, {}
+        
+        # The unique indexes reject clashes with users outside the batch; raising
+        # rolls back this job's savepoint, so no edit in the batch is applied
+        cursor.executemany(_UPDATE_USER_SQL, [
+            (row['username'], row['email'], row['role'], row['role'], user_id)
+            for user_id, row in changed.items()
+        ])
+        return True, f"Updated {len(changed)} user(s)", current, changed
+    
+    try:
+        success, message, current, changed = _write_queue.run(write)
+    except ServerBusyError:
+        return False, SERVER_BUSY_MESSAGE
+    except sqlite3.IntegrityError:
+        return False, "Username or email already exists"
     except sqlite3.Error as e:
         return False, f"Database error: {str(e)}"
+    
+    if changed:
+        _user_cache.invalidate()
+        for row in changed.values():
+            _membership_index.add(row['username'], row['email'])
+        _membership_index.note_removed(len(changed))
+        for user_id, row in changed.items():
+            record_auth_event('user_updated', row['username'], user_id, '; '.join(
+                f"{field}: {current[user_id][field]} -> {value}"
+                for field, value in row.items() if current[user_id][field] != value
+            ))
+    return success, message
+
+_USER_BY_ID_SQL = _register_query('get_user_by_id', """
+    SELECT id, username, email, role, created_at, session_version 
+    FROM users WHERE id = ?
+""", (2,))
 
+@handle_db_operation
 def get_user_by_id(user_id):
     """Get user details by ID"""
-    try:
+    def load_user():
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT id, username, email, role, created_at 
-                FROM users WHERE id = ?
-            """, (user_id,))
+            cursor.execute(_USER_BY_ID_SQL, (user_id,))
             
             user = cursor.fetchone()
             return dict(user) if user else None
+    
+    try:
+        return _user_cache.get_or_load(('user', user_id), load_user)
             
     except sqlite3.Error:
         return None
 
+_AUTH_ROLLUPS_SQL = _register_query('get_auth_rollups', """
+    SELECT bucket, login_successes, login_failures, login_throttled, registrations, distinct_users
+    FROM auth_event_rollups
+    WHERE granularity = ? AND bucket >= ?
+    ORDER BY bucket
+""", ('hour', '2025-01-01 00'))
+
+@handle_db_operation
+def get_auth_rollups(granularity, since):
+    """
+    Get login analytics buckets starting at or after since (a UTC datetime), oldest first
+    Reads one row per bucket that had events, never the raw event log.
+    Returns: list of dicts with 'bucket' (UTC datetime), 'login_successes', 'login_failures',
+             'login_throttled', 'registrations' and 'distinct_users'
+    """
+    bucket_format = AUTH_ROLLUP_GRANULARITIES.get(granularity)
+    if bucket_format is None:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    
+    try:
+        with get_db_connection() as conn:
+            rows = conn.execute(_AUTH_ROLLUPS_SQL, (granularity, since.strftime(bucket_format))).fetchall()
+    except sqlite3.Error:
+        return []
+    
+    return [dict(row, bucket=datetime.strptime(row['bucket'], bucket_format)) for row in rows]
+
 # Initialize database when module is imported
 init_database()
+
+if METRICS_PORT:
+    metrics.start_metrics_server(METRICS_PORT)
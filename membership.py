@@ -0,0 +1,46 @@
+"""
+Bloom filter for fast "definitely not present" membership checks.
+
+Used by database.py to answer username/email availability without querying
+SQLite; any positive answer must still be confirmed against the database.
+"""
+import hashlib
+import math
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings with double hashing"""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, int(capacity))
+        self.error_rate = error_rate
+        # Standard sizing: m = -n ln(p) / ln(2)^2 bits and k = (m / n) ln(2) hashes
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0  # Distinct items added (items that set at least one new bit)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add item; returns True if it was not already (apparently) present"""
+        added = False
+        for position in self._positions(item):
+            byte, mask = position >> 3, 1 << (position & 7)
+            if not self._bits[byte] & mask:
+                self._bits[byte] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    @property
+    def size_bytes(self):
+        return len(self._bits)
@@ -0,0 +1,229 @@
+"""
+Lightweight in-process metrics.
+
+Counters, latency histograms, gauges and a slow-call log, rendered in the
+Prometheus text exposition format so they can be scraped from a local HTTP
+endpoint or shown in the admin dashboard.
+"""
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond lookups up to slow bcrypt calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    """Cumulative latency histogram with fixed bucket bounds"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, fraction):
+        """Estimate a quantile as the upper bound of the bucket containing it"""
+        if not self.count:
+            return 0.0
+        target = fraction * self.count
+        running = 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            if running >= target:
+                return bound
+        return float('inf')
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape_label(value)}"' for key, value in labels) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsRegistry:
+    """Thread-safe store of counters, histograms and gauge callbacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._help = {}
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def inc(self, name, labels=None, amount=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def gauge(self, name, callback, help_text=None):
+        """Register callback() returning a number or a {((label, value), ...): sample} mapping"""
+        self._gauges[name] = callback
+        if help_text:
+            self.describe(name, help_text)
+
+    def counter_value(self, name, labels=None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def histogram_summary(self, name):
+        """Per-label-set count, mean and estimated p50/p95/p99 in milliseconds"""
+        with self._lock:
+            items = [(labels, h) for (metric, labels), h in self._histograms.items() if metric == name]
+            return [
+                {
+                    **dict(labels),
+                    'count': h.count,
+                    'mean_ms': h.sum / h.count * 1000 if h.count else 0.0,
+                    'p50_ms': h.quantile(0.50) * 1000,
+                    'p95_ms': h.quantile(0.95) * 1000,
+                    'p99_ms': h.quantile(0.99) * 1000,
+                }
+                for labels, h in sorted(items)
+            ]
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        lines = []
+
+        def header(name, metric_type):
+            if name in self._help:
+                lines.append(f'# HELP {name} {self._help[name]}')
+            lines.append(f'# TYPE {name} {metric_type}')
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(
+                ((name, labels, list(h.buckets), list(h.counts), h.sum, h.count)
+                 for (name, labels), h in self._histograms.items()),
+                key=lambda item: (item[0], item[1])
+            )
+
+        current = None
+        for (name, labels), value in counters:
+            if name != current:
+                header(name, 'counter')
+                current = name
+            lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+
+        current = None
+        for name, labels, buckets, counts, total, count in histograms:
+            if name != current:
+                header(name, 'histogram')
+                current = name
+            running = 0
+            for bound, bucket_count in zip(list(buckets) + [float('inf')], counts):
+                running += bucket_count
+                bucket_labels = labels + (('le', _format_value(bound)),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {running}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+
+        for name, callback in sorted(self._gauges.items()):
+            try:
+                value = callback()
+            except Exception:
+                logger.exception("Gauge callback for %s failed", name)
+                continue
+            header(name, 'gauge')
+            if isinstance(value, dict):
+                for labels, sample in sorted(value.items()):
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(sample)}')
+            else:
+                lines.append(f'{name} {_format_value(value)}')
+
+        return '\n'.join(lines) + '\n'
+
+class SlowCallLog:
+    """Bounded log of the most recent calls above a latency threshold"""
+
+    def __init__(self, threshold_ms, max_entries=200):
+        self.threshold_ms = threshold_ms
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def record(self, operation, elapsed_ms, **details):
+        if elapsed_ms < self.threshold_ms:
+            return
+        entry = {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'operation': operation,
+            'elapsed_ms': round(elapsed_ms, 2),
+            **details,
+        }
+        with self._lock:
+            self._entries.append(entry)
+        logger.warning("Slow call: %s took %.1f ms %s", operation, elapsed_ms, details)
+
+    def entries(self):
+        """Most recent entries first"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+# Process-wide registry shared by every module
+registry = MetricsRegistry()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood stderr
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_metrics_server(port, host='127.0.0.1'):
+    """
+    Serve registry.render() at http://host:port/metrics from a daemon thread
+    Returns: True if the server is running, False if the port could not be bound
+    """
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return True
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            # Another server process on this machine may already own the port
+            logger.warning("Metrics endpoint not started on %s:%s: %s", host, port, e)
+            return False
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name='coplur-metrics', daemon=True).start()
+        return True
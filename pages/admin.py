@@ -1,7 +1,16 @@
+import csv
+import io
+from datetime import datetime, timedelta, timezone
 import streamlit as st
 import pandas as pd
 from auth import require_admin, get_current_user, display_user_info, show_navigation, show_persistent_message, check_persistent_messages
-from database import get_all_users, create_user, delete_user, get_user_by_id, update_user
+from database import (
+    list_users, search_users, get_role_counts, create_user, bulk_create_users, export_users,
+    get_user_by_id, update_user, bulk_update_users, bulk_delete_users, bulk_update_roles,
+    get_pool_stats, get_cache_stats, get_hashing_stats, get_latency_summary,
+    get_slow_queries, get_auth_event_stats, get_auth_rollups, render_metrics
+)
+from security import get_rate_limit_stats
 
 # Page configuration
 st.set_page_config(
@@ -23,20 +32,40 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# User listing options
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+SORT_LABELS = {
+    'newest': "Newest first",
+    'oldest': "Oldest first",
+    'username': "Username (A-Z)",
+}
+ROLE_FILTER_LABELS = {
+    "All roles": None,
+    "Admins": 'admin',
+    "Students": 'student',
+}
+GRID_COLUMNS = ['id', 'username', 'email', 'role', 'created_at']
+GRID_EDITABLE_COLUMNS = ['username', 'email', 'role']
+
+# Login analytics ranges: (rollup granularity, span, pandas frequency of one bucket)
+ANALYTICS_RANGES = {
+    "Last hour": ('minute', timedelta(hours=1), 'min'),
+    "Last 24 hours": ('hour', timedelta(days=1), 'h'),
+    "Last 7 days": ('hour', timedelta(days=7), 'h'),
+    "Last 90 days": ('day', timedelta(days=90), 'D'),
+}
+PEAK_HOURS_WINDOW = timedelta(days=7)  # Hourly buckets behind the hour-of-day profile
+
 def show_admin_header():
     """Display admin dashboard header"""
     st.title("👑 Admin Dashboard")
 
 def show_user_stats():
     """Display user statistics"""
-    users = get_all_users()
-    
-    if users:
-        total_users = len(users)
-        admin_count = len([u for u in users if u['role'] == 'admin'])
-        student_count = len([u for u in users if u['role'] == 'student'])
-    else:
-        total_users = admin_count = student_count = 0
+    counts = get_role_counts()
+    total_users = counts['total']
+    admin_count = counts['admin']
+    student_count = counts['student']
     
     col1, col2, col3 = st.columns(3)
     
@@ -88,6 +117,212 @@ def create_user_form():
             else:
                 show_persistent_message('error', "Please fill in all fields")
 
+def read_import_rows(uploaded_file):
+    """Stream rows from an uploaded CSV file with normalised column names"""
+    reader = csv.DictReader(io.TextIOWrapper(uploaded_file, encoding='utf-8-sig', newline=''))
+    for row in reader:
+        extra = row.pop(None, None)
+        normalised = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if extra is not None:
+            # Keep the extra fields so bulk_create_users can reject the row
+            normalised[None] = extra
+        yield normalised
+
+def bulk_import_form():
+    """Display bulk CSV user import form"""
+    st.subheader("📥 Bulk Import Users")
+    
+    with st.expander("📄 CSV Format", expanded=False):
+        st.markdown("""
+        The file needs a header row with these columns:
+        - **username** (required)
+        - **email** (required)
+        - **password** (required, at least 8 characters with letters and numbers)
+        - **role** (optional, `student` or `admin`; defaults to `student`)
+        """)
+        st.code("username,email,password,role\njdoe,jdoe@example.com,Welcome123,student")
+    
+    with st.form("bulk_import_form"):
+        uploaded_file = st.file_uploader("CSV file", type=["csv"])
+        submit_button = st.form_submit_button("Import Users", use_container_width=True)
+    
+    if submit_button:
+        if uploaded_file is None:
+            show_persistent_message('error', "Please choose a CSV file to import")
+            return
+        
+        with st.spinner("Importing users..."):
+            try:
+                created, errors = bulk_create_users(read_import_rows(uploaded_file))
+            except (UnicodeDecodeError, csv.Error) as e:
+                show_persistent_message('error', f"❌ Could not read CSV file: {str(e)}")
+                return
+        
+        if created:
+            show_persistent_message('success', f"✅ Imported {created} user(s)")
+        
+        if errors:
+            st.warning(f"⚠️ {len(errors)} row(s) were not imported")
+            st.dataframe(pd.DataFrame(errors), use_container_width=True, hide_index=True)
+        elif not created:
+            show_persistent_message('info', "The file contained no users to import")
+
+def export_users_form():
+    """Display user export options and download button"""
+    st.subheader("📤 Export Users")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        export_format = st.radio("Format", ["csv", "jsonl"], format_func=str.upper,
+                                 horizontal=True, key="export_format")
+        role_label = st.selectbox("Role", list(ROLE_FILTER_LABELS), key="export_role_filter")
+    
+    with col2:
+        filter_dates = st.checkbox("Filter by creation date", key="export_filter_dates")
+        created_from = created_to = None
+        if filter_dates:
+            created_from = st.date_input("Created from", key="export_created_from")
+            created_to = st.date_input("Created to", key="export_created_to")
+    
+    if st.button("📦 Prepare Export", key="prepare_export"):
+        # Streamlit serves downloads from memory, so write chunks straight into
+        # one byte buffer instead of materialising the user list first
+        export_file = io.BytesIO()
+        with st.spinner("Exporting users..."):
+            for chunk in export_users(export_format, ROLE_FILTER_LABELS[role_label],
+                                      created_from, created_to):
+                export_file.write(chunk.encode('utf-8'))
+        
+        mime = "text/csv" if export_format == 'csv' else "application/x-ndjson"
+        st.download_button(
+            "⬇️ Download Export",
+            data=export_file,
+            file_name=f"coplur_users.{export_format}",
+            mime=mime,
+            key="download_export"
+        )
+
+def show_metrics_dashboard():
+    """Display database layer metrics"""
+    st.subheader("📈 System Metrics")
+    
+    pool = get_pool_stats()
+    cache = get_cache_stats()
+    hashing = get_hashing_stats()
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("🔌 Connections In Use", f"{pool['in_use']} / {pool['size']}")
+    
+    with col2:
+        st.metric("⏳ Pool Waits", pool['waits'], help=f"Average wait {pool['wait_time_avg'] * 1000:.1f} ms")
+    
+    with col3:
+        st.metric("🗂️ Cache Hit Rate", f"{cache['hit_rate']:.0%}")
+    
+    with col4:
+        st.metric("🚦 Hashing Rejections", hashing['rejected'])
+    
+    throttles = get_rate_limit_stats()
+    events = get_auth_event_stats()
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("🛑 Logins Throttled by Username", throttles['username']['throttled'])
+    
+    with col2:
+        st.metric("🛑 Logins Throttled by Address", throttles['address']['throttled'])
+    
+    with col3:
+        st.metric(
+            "📇 Tracked Login Keys",
+            throttles['username']['tracked'] + throttles['address']['tracked'],
+            help=f"Evicted: {throttles['username']['evictions'] + throttles['address']['evictions']}"
+        )
+    
+    with col4:
+        st.metric(
+            "📝 Auth Events Dropped",
+            events['dropped'] + events['failed'],
+            help=f"Written: {events['written']} in {events['batches']} batches, pending: {events['pending']}"
+        )
+    
+    st.markdown("**⏱️ Latency by Function**")
+    latency = get_latency_summary()
+    if latency:
+        st.dataframe(pd.DataFrame(latency), use_container_width=True, hide_index=True)
+    else:
+        st.info("No calls recorded yet.")
+    
+    st.markdown("**🐢 Slow Queries**")
+    slow_queries = get_slow_queries()
+    if slow_queries:
+        st.dataframe(pd.DataFrame(slow_queries), use_container_width=True, hide_index=True)
+    else:
+        st.info("No slow queries recorded.")
+    
+    with st.expander("📄 Raw Metrics (Prometheus format)", expanded=False):
+        st.code(render_metrics(), language="text")
+
+def show_login_analytics():
+    """Display login volume, failure rate and peak hours from the pre-aggregated rollups"""
+    st.subheader("📊 Login Analytics")
+    
+    range_label = st.selectbox("Time range", list(ANALYTICS_RANGES), index=1, key="analytics_range")
+    granularity, span, frequency = ANALYTICS_RANGES[range_label]
+    
+    # Rollup buckets are in UTC, like every timestamp in the database
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rollups = get_auth_rollups(granularity, now - span)
+    if not rollups:
+        st.info("No login activity recorded in this period.")
+        return
+    
+    df = pd.DataFrame(rollups).set_index('bucket')
+    successes = int(df['login_successes'].sum())
+    failures = int(df['login_failures'].sum())
+    attempts = successes + failures
+    
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        st.metric("✅ Successful Logins", successes)
+    
+    with col2:
+        st.metric("❌ Failed Logins", failures, help=f"Throttled before checking: {int(df['login_throttled'].sum())}")
+    
+    with col3:
+        st.metric("📉 Failure Rate", f"{failures / attempts:.1%}" if attempts else "—")
+    
+    with col4:
+        st.metric("🆕 Registrations", int(df['registrations'].sum()))
+    
+    # Buckets without events have no rollup row; fill them so the time axis is continuous
+    buckets = pd.date_range(pd.Timestamp(now - span).floor(frequency), pd.Timestamp(now).floor(frequency), freq=frequency)
+    df = df.reindex(buckets, fill_value=0)
+    
+    st.markdown(f"**🔐 Logins per {granularity} (UTC)**")
+    st.line_chart(df[['login_successes', 'login_failures', 'login_throttled']].rename(columns={
+        'login_successes': "Successful", 'login_failures': "Failed", 'login_throttled': "Throttled",
+    }))
+    
+    st.markdown(f"**👤 Active users and registrations per {granularity}**")
+    st.bar_chart(df[['distinct_users', 'registrations']].rename(columns={
+        'distinct_users': "Users logged in", 'registrations': "Registrations",
+    }), stack=False)
+    
+    hourly = get_auth_rollups('hour', now - PEAK_HOURS_WINDOW)
+    if hourly:
+        hourly = pd.DataFrame(hourly)
+        attempts_by_hour = (hourly['login_successes'] + hourly['login_failures']).groupby(
+            hourly['bucket'].dt.hour
+        ).sum().reindex(range(24), fill_value=0)
+        st.markdown(f"**⏰ Login attempts by hour of day (UTC, last {PEAK_HOURS_WINDOW.days} days)**")
+        st.bar_chart(attempts_by_hour.rename("Attempts"))
+        st.caption(f"Peak hour: {attempts_by_hour.idxmax():02d}:00–{attempts_by_hour.idxmax():02d}:59 UTC")
+
 def edit_user_form(user_id):
     """Display edit user form"""
     user = get_user_by_id(user_id)
@@ -100,8 +335,7 @@ def edit_user_form(user_id):
     # Check if this is an admin and if they're the last admin
     is_last_admin = False
     if user['role'] == 'admin':
-        all_users = get_all_users()
-        admin_count = len([u for u in all_users if u['role'] == 'admin'])
+        admin_count = get_role_counts()['admin']
         is_last_admin = admin_count <= 1
         
         if is_last_admin:
@@ -137,108 +371,221 @@ def edit_user_form(user_id):
                 success, message = update_user(user_id, username, email, role)
                 if success:
                     show_persistent_message('success', f"✅ {message}")
-                    # Clear edit state
-                    if f'edit_user_{user_id}' in st.session_state:
-                        del st.session_state[f'edit_user_{user_id}']
-                    # Don't rerun immediately to let user see the message
+                    # Untick the user so the panel closes
+                    reset_users_grid()
+                    st.rerun()
                 else:
                     show_persistent_message('error', f"❌ {message}")
             else:
                 show_persistent_message('error', "Please fill in all fields")
         
         if cancel_button:
-            # Clear edit state
-            if f'edit_user_{user_id}' in st.session_state:
-                del st.session_state[f'edit_user_{user_id}']
+            reset_users_grid()
             st.rerun()
 
-def display_users_table():
-    """Display users in a formatted table"""
-    users = get_all_users()
+def reset_users_grid():
+    """Drop unsaved grid edits and ticked rows by giving the grid a fresh key"""
+    st.session_state.users_grid_version = st.session_state.get('users_grid_version', 0) + 1
+
+def show_listing_controls():
+    """Display search, page size, sort and role filter controls"""
+    search = st.text_input(
+        "🔍 Search users", key="users_search", placeholder="Username or email",
+        help="Best matches first: username prefixes, then matches anywhere, then close spellings"
+    ).strip()
     
-    if not users:
-        st.info("No users found in the system.")
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        page_size = st.selectbox("Users per page", PAGE_SIZE_OPTIONS, index=1, key="users_page_size")
+    
+    with col2:
+        sort = st.selectbox("Sort by", list(SORT_LABELS), format_func=SORT_LABELS.get, key="users_sort",
+                            disabled=bool(search), help="Search results are ordered by relevance")
+    
+    with col3:
+        role_label = st.selectbox("Role", list(ROLE_FILTER_LABELS), key="users_role_filter")
+    
+    role_filter = ROLE_FILTER_LABELS[role_label]
+    
+    # Start again from the first page whenever the listing changes
+    listing_key = (search, page_size, sort, role_filter)
+    if st.session_state.get('users_listing_key') != listing_key:
+        st.session_state.users_listing_key = listing_key
+        st.session_state.users_page_cursors = [None]
+        reset_users_grid()
+    
+    return search, page_size, sort, role_filter
+
+def show_page_navigation(next_cursor):
+    """Display previous/next page buttons"""
+    # Stack of cursors for the pages visited so far; the last one is the current page
+    cursors = st.session_state.users_page_cursors
+    
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    
+    with col_prev:
+        if st.button("← Previous", key="users_prev_page", disabled=len(cursors) <= 1):
+            cursors.pop()
+            reset_users_grid()
+            st.rerun()
+    
+    with col_page:
+        st.caption(f"Page {len(cursors)}")
+    
+    with col_next:
+        if st.button("Next →", key="users_next_page", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            reset_users_grid()
+            st.rerun()
+
+def users_grid_frame(users):
+    """Build the grid's DataFrame, indexed by user ID"""
+    df = pd.DataFrame(users, columns=GRID_COLUMNS).set_index('id')
+    df.insert(0, 'selected', False)
+    return df
+
+def get_grid_changes(original, edited):
+    """Map user ID to the editable fields of every row that differs from what was loaded"""
+    changed = (original[GRID_EDITABLE_COLUMNS] != edited[GRID_EDITABLE_COLUMNS]).any(axis=1)
+    return {
+        int(user_id): edited.loc[user_id, GRID_EDITABLE_COLUMNS].to_dict()
+        for user_id in original.index[changed]
+    }
+
+def show_grid_save_bar(changes):
+    """Display save/discard buttons for the pending grid edits"""
+    col_info, col_save, col_discard = st.columns([2, 1, 1])
+    
+    with col_info:
+        st.caption(f"✏️ {len(changes)} user(s) edited, not saved yet" if changes
+                   else "Edit usernames, emails and roles in the grid, then save them together.")
+    
+    with col_save:
+        if st.button("💾 Save Changes", key="users_grid_save", disabled=not changes, use_container_width=True):
+            success, message = bulk_update_users(changes)
+            if success:
+                show_persistent_message('success', f"✅ {message}")
+                reset_users_grid()
+                st.rerun()
+            else:
+                show_persistent_message('error', f"❌ {message}")
+    
+    with col_discard:
+        if st.button("↩️ Discard", key="users_grid_discard", disabled=not changes, use_container_width=True):
+            reset_users_grid()
+            st.rerun()
+
+def show_selection_panel(selected_ids):
+    """Display delete/role actions for the ticked users, and the edit form when only one is ticked"""
+    if not selected_ids:
         return
     
-    st.subheader("👥 User Management")
+    st.info(f"☑️ {len(selected_ids)} user(s) selected")
+    col_delete, col_role, col_apply = st.columns([1, 1, 1])
     
-    # Convert to DataFrame for better display
-    df = pd.DataFrame(users)
-    
-    # Format the display
-    df['Actions'] = range(len(df))  # Placeholder for action buttons
-    
-    # Display table
-    st.markdown('<div class="user-table">', unsafe_allow_html=True)
-    
-    # Count admins for last admin protection
-    admin_count = len([u for u in users if u['role'] == 'admin'])
-    
-    for idx, user in enumerate(users):
-        with st.container():
-            col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 1, 1])
-            
-            with col1:
-                st.write(f"**{user['username']}**")
-                st.caption(f"ID: {user['id']}")
-            
-            with col2:
-                st.write(user['email'])
-            
-            with col3:
-                role_color = "🔴" if user['role'] == 'admin' else "🔵"
-                role_text = f"{role_color} {user['role'].title()}"
-                # Add indicator for last admin
-                if user['role'] == 'admin' and admin_count <= 1:
-                    role_text += " (Last Admin)"
-                st.write(role_text)
-            
-            with col4:
-                # Show edit button for all users
-                if st.button("📝", key=f"edit_{user['id']}", help="Edit user"):
-                    st.session_state[f'edit_user_{user["id"]}'] = True
-            
-            with col5:
-                # Prevent deletion of current admin
-                current_user = get_current_user()
-                can_delete = user['id'] != current_user['id']
-                
-                if can_delete:
-                    if st.button("🗑️", key=f"delete_{user['id']}", help="Delete user"):
-                        st.session_state[f'confirm_delete_{user["id"]}'] = True
-                else:
-                    st.button("🚫", key=f"nodelete_{user['id']}", help="Cannot delete yourself", disabled=True)
+    with col_delete:
+        if st.button("🗑️ Delete Selected", key="bulk_delete", use_container_width=True):
+            st.session_state.confirm_bulk_delete = True
+    
+    with col_role:
+        new_role = st.selectbox("Set role", ["student", "admin"], key="bulk_role",
+                                label_visibility="collapsed")
+    
+    with col_apply:
+        if st.button("🏷️ Set Role", key="bulk_set_role", use_container_width=True):
+            success, message = bulk_update_roles(selected_ids, new_role)
+            if success:
+                show_persistent_message('success', f"✅ {message}")
+                reset_users_grid()
+                st.rerun()
+            else:
+                show_persistent_message('error', f"❌ {message}")
+    
+    # Handle bulk delete confirmation
+    if st.session_state.get('confirm_bulk_delete', False):
+        # Prevent deletion of current admin
+        current_user = get_current_user()
+        delete_ids = [user_id for user_id in selected_ids if user_id != current_user['id']]
+        if len(delete_ids) < len(selected_ids):
+            st.caption("Your own account is excluded from deletion.")
         
-        # Handle delete confirmation
-        if st.session_state.get(f'confirm_delete_{user["id"]}', False):
-            st.warning(f"⚠️ Are you sure you want to delete user '{user['username']}'?")
-            col_yes, col_no = st.columns(2)
-            
-            with col_yes:
-                if st.button("Yes, Delete", key=f"yes_delete_{user['id']}"):
-                    success, message = delete_user(user['id'])
-                    if success:
-                        show_persistent_message('success', f"✅ {message}")
-                        # Clear confirmation state
-                        del st.session_state[f'confirm_delete_{user["id"]}']
-                        # Don't rerun immediately to let user see the message
-                    else:
-                        show_persistent_message('error', f"❌ {message}")
-            
-            with col_no:
-                if st.button("Cancel", key=f"cancel_delete_{user['id']}"):
-                    del st.session_state[f'confirm_delete_{user["id"]}']
-                    st.rerun()
+        st.warning(f"⚠️ Are you sure you want to delete {len(delete_ids)} selected user(s)?")
+        col_yes, col_no = st.columns(2)
         
-        # Handle edit form
-        if st.session_state.get(f'edit_user_{user["id"]}', False):
-            st.markdown("---")
-            edit_user_form(user['id'])
-            st.markdown("---")
+        with col_yes:
+            if st.button("Yes, Delete", key="yes_bulk_delete", disabled=not delete_ids):
+                del st.session_state.confirm_bulk_delete
+                success, message = bulk_delete_users(delete_ids)
+                if success:
+                    show_persistent_message('success', f"✅ {message}")
+                    reset_users_grid()
+                    st.rerun()
+                else:
+                    show_persistent_message('error', f"❌ {message}")
         
+        with col_no:
+            if st.button("Cancel", key="cancel_bulk_delete"):
+                del st.session_state.confirm_bulk_delete
+                st.rerun()
+    
+    if len(selected_ids) == 1:
         st.markdown("---")
+        edit_user_form(selected_ids[0])
+
+def display_users_table():
+    """Display one page of users as an editable grid"""
+    st.subheader("👥 User Management")
+    
+    search, page_size, sort, role_filter = show_listing_controls()
+    if search:
+        # Ranked top matches from the search index instead of a page of the listing
+        users = search_users(search, role_filter, limit=page_size)
+        next_cursor = None
+    else:
+        page = list_users(
+            cursor=st.session_state.users_page_cursors[-1],
+            limit=page_size,
+            sort=sort,
+            role_filter=role_filter
+        )
+        users = page['users']
+        next_cursor = page['next_cursor']
+    
+    if not users:
+        st.info(f"No users match '{search}'." if search else "No users found in the system.")
+        if not search:
+            show_page_navigation(None)
+        return
+    
+    # One grid widget however many users are shown; edits stay in its state until saved
+    original = users_grid_frame(users)
+    edited = st.data_editor(
+        original,
+        key=f"users_grid_{st.session_state.get('users_grid_version', 0)}",
+        column_config={
+            'selected': st.column_config.CheckboxColumn("Select", width="small"),
+            '_index': st.column_config.NumberColumn("ID"),
+            'username': st.column_config.TextColumn("Username", required=True, max_chars=20),
+            'email': st.column_config.TextColumn("Email", required=True, max_chars=100),
+            'role': st.column_config.SelectboxColumn("Role", options=["student", "admin"], required=True),
+            'created_at': st.column_config.TextColumn("Created"),
+        },
+        disabled=['_index', 'created_at'],
+        num_rows="fixed",
+        use_container_width=True,
+    )
     
-    st.markdown('</div>', unsafe_allow_html=True)
+    if get_role_counts()['admin'] <= 1:
+        st.caption("🔴 Only one admin is left; their role can't be changed and they can't be deleted.")
+    
+    show_grid_save_bar(get_grid_changes(original, edited))
+    show_selection_panel([int(user_id) for user_id in edited.index[edited['selected']]])
+    
+    if search:
+        st.caption(f"Showing the {len(users)} best match(es) for '{search}'")
+    else:
+        show_page_navigation(next_cursor)
 
 def main():
     """Main admin dashboard logic"""
@@ -256,13 +603,27 @@ def main():
     st.markdown("---")
     
     # Create tabs for different admin functions
-    tab1, tab2 = st.tabs(["👥 Manage Users", "➕ Create User"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+        ["👥 Manage Users", "➕ Create User", "📥 Bulk Import", "📤 Export", "📊 Analytics", "📈 Metrics"]
+    )
     
     with tab1:
         display_users_table()
     
     with tab2:
         create_user_form()
+    
+    with tab3:
+        bulk_import_form()
+    
+    with tab4:
+        export_users_form()
+    
+    with tab5:
+        show_login_analytics()
+    
+    with tab6:
+        show_metrics_dashboard()
 
 if __name__ == "__main__":
     main()
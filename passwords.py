@@ -0,0 +1,64 @@
+"""
+Password hashing primitives.
+
+Kept free of database side effects so hashing worker processes can import
+this module cheaply instead of re-running database initialisation.
+"""
+import base64
+import hashlib
+import hmac
+import os
+
+import bcrypt
+
+SCRYPT_PREFIX = '$scrypt$'
+SCRYPT_SALT_BYTES = 16
+SCRYPT_KEY_BYTES = 32
+
+def bcrypt_hash(password, rounds=12):
+    """Hash password using bcrypt at the given cost"""
+    salt = bcrypt.gensalt(rounds)
+    return bcrypt.hashpw(password.encode('utf-8'), salt)
+
+def bcrypt_verify(password, hashed):
+    """Verify password against a bcrypt hash"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed)
+
+def bcrypt_rounds(hashed):
+    """Read the cost factor out of a bcrypt hash ($2b$12$...)"""
+    return int(hashed[4:6])
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 2 ** log_n
+    return hashlib.scrypt(
+        password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+        maxmem=256 * n * r,  # Default limit of 32 MB is too low above log_n=14
+        dklen=SCRYPT_KEY_BYTES,
+    )
+
+def scrypt_hash(password, log_n=14, r=8, p=1):
+    """Hash password using hashlib.scrypt, encoded as $scrypt$ln=..,r=..,p=..$salt$key"""
+    salt = os.urandom(SCRYPT_SALT_BYTES)
+    key = _scrypt(password, salt, log_n, r, p)
+    return '{}ln={},r={},p={}${}${}'.format(
+        SCRYPT_PREFIX, log_n, r, p,
+        base64.b64encode(salt).decode('ascii'), base64.b64encode(key).decode('ascii'),
+    )
+
+def scrypt_params(hashed):
+    """
+    Parse an encoded scrypt hash
+    Returns: (params dict with log_n, r and p, salt bytes, key bytes)
+    """
+    params_part, salt_part, key_part = hashed[len(SCRYPT_PREFIX):].split('$')
+    params = dict(item.split('=') for item in params_part.split(','))
+    return (
+        {'log_n': int(params['ln']), 'r': int(params['r']), 'p': int(params['p'])},
+        base64.b64decode(salt_part),
+        base64.b64decode(key_part),
+    )
+
+def scrypt_verify(password, hashed):
+    """Verify password against an encoded scrypt hash"""
+    params, salt, key = scrypt_params(hashed)
+    return hmac.compare_digest(_scrypt(password, salt, **params), key)
@@ -0,0 +1,97 @@
+"""
+Check the query plan of every statement in database.QUERY_REGISTRY.
+
+Builds a scratch database seeded with users, runs EXPLAIN QUERY PLAN on each
+registered statement with its sample parameters, and exits non-zero if a hot
+statement scans the users table or sorts it in a temporary B-tree. An
+index-ordered scan is allowed for statements registered as bounded, since
+their LIMIT stops it after one page. Run it in CI after changing any SQL in
+database.py.
+
+Usage:
+    python scripts/audit_query_plans.py --users 5000 --verbose
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SCAN_USERS = re.compile(r'^SCAN users\b')
+INDEX_ORDERED_SCAN = re.compile(r'^SCAN users USING (COVERING )?INDEX ')
+TEMP_SORT = re.compile(r'^USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Audit query plans of registered database statements")
+    parser.add_argument('--users', type=int, default=5000, help="users to seed the scratch database with")
+    parser.add_argument('--verbose', action='store_true', help="print the plan of every statement")
+    return parser.parse_args()
+
+def seed_users(database_file, count):
+    """Insert synthetic users directly; the plans don't depend on real password hashes"""
+    conn = sqlite3.connect(database_file)
+    with conn:
+        conn.executemany("""
+            INSERT INTO users (username, email, password_hash, role, created_at)
+            VALUES (?, ?, 'x', ?, datetime('2025-01-01', ? || ' minutes'))
+        """, [
+            (f'user_{i:06d}', f'user_{i:06d}@example.com', 'admin' if i % 50 == 0 else 'student', i)
+            for i in range(count)
+        ])
+    conn.close()
+
+def explain(conn, sql, params):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def check_plan(entry, plan):
+    """Return a list of problems with one statement's plan"""
+    problems = []
+    for detail in plan:
+        if SCAN_USERS.match(detail) and not (entry['bounded'] and INDEX_ORDERED_SCAN.match(detail)):
+            problems.append(detail)
+        elif TEMP_SORT.match(detail):
+            problems.append(detail)
+    return problems
+
+def main():
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_file = os.path.join(tmp_dir, 'audit.db')
+        # Must be set before database is imported, since importing it initialises the file
+        os.environ['COPLUR_DATABASE_FILE'] = database_file
+        os.environ['COPLUR_HASH_WORKERS'] = '0'
+        os.environ['COPLUR_BCRYPT_ROUNDS'] = '4'
+        import database
+
+        seed_users(database_file, args.users)
+        failures = 0
+        conn = sqlite3.connect(database_file)
+        try:
+            for name, entry in sorted(database.QUERY_REGISTRY.items()):
+                plan = explain(conn, entry['sql'], entry['params'])
+                problems = check_plan(entry, plan)
+                if problems and entry['hot']:
+                    failures += 1
+                    status = 'FAIL'
+                elif problems:
+                    status = 'warn'
+                else:
+                    status = 'ok'
+
+                print(f"{status:<4}  {name}{'' if entry['hot'] else '  (not hot)'}")
+                for detail in plan if (args.verbose or problems) else []:
+                    print(f"        {detail}")
+        finally:
+            conn.close()
+            database.close_pool()
+
+    print(f"{len(database.QUERY_REGISTRY)} statements checked, {failures} hot-path statement(s) scan or sort users")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
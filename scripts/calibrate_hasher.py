@@ -0,0 +1,45 @@
+"""
+Pick password hashing parameters for a target latency on this machine.
+
+Prints the environment variables to set so new hashes use the calibrated
+cost; existing hashes are upgraded transparently on their owner's next login.
+
+Usage:
+    python scripts/calibrate_hasher.py --scheme bcrypt --target-ms 250
+"""
+import argparse
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate password hashing cost")
+    parser.add_argument('--scheme', choices=['bcrypt', 'scrypt'], default='bcrypt')
+    parser.add_argument('--target-ms', type=float, default=250,
+                        help="desired time per hash in milliseconds")
+    parser.add_argument('--max-ms', type=float,
+                        help="never pick parameters slower than this (default: target)")
+    args = parser.parse_args()
+
+    # Calibration doesn't need real data; keep the import from initialising a database here
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ['COPLUR_DATABASE_FILE'] = os.path.join(tmp_dir, 'calibrate.db')
+        import database
+
+        params = database.calibrate_hasher(args.scheme, args.target_ms, args.max_ms)
+        database.close_pool()
+
+    print(f"# {args.scheme}: {params['ms']} ms per hash on this machine")
+    print(f"COPLUR_PASSWORD_SCHEME={args.scheme}")
+    if args.scheme == 'bcrypt':
+        print(f"COPLUR_BCRYPT_ROUNDS={params['rounds']}")
+    else:
+        print(f"COPLUR_SCRYPT_LOG_N={params['log_n']}")
+        print(f"COPLUR_SCRYPT_R={params['r']}")
+        print(f"COPLUR_SCRYPT_P={params['p']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Export the user directory as CSV or JSONL.
+
+Rows are streamed from SQLite in chunks, so memory stays flat regardless of
+how many users there are.
+
+Usage:
+    python scripts/export_users.py --format jsonl --role student --from 2025-01-01 -o students.jsonl
+"""
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Export Coplur users as CSV or JSONL")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv', help="output format")
+    parser.add_argument('--role', choices=['admin', 'student'], help="only export users with this role")
+    parser.add_argument('--from', dest='created_from', metavar='YYYY-MM-DD',
+                        help="only users created on or after this date")
+    parser.add_argument('--to', dest='created_to', metavar='YYYY-MM-DD',
+                        help="only users created on or before this date")
+    parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    parser.add_argument('--database', help="SQLite database file (default: COPLUR_DATABASE_FILE or coplur_users.db)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    # Must be set before database is imported, since importing it initialises the file
+    if args.database:
+        os.environ['COPLUR_DATABASE_FILE'] = args.database
+    from database import export_users
+
+    chunks = export_users(args.format, args.role, args.created_from, args.created_to)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8', newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
+    else:
+        for chunk in chunks:
+            sys.stdout.write(chunk)
+
+if __name__ == "__main__":
+    main()
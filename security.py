@@ -0,0 +1,252 @@
+"""
+Streamlit-free security helpers shared by the UI and the JSON auth service.
+
+Holds the role rules used by auth.require_role, HMAC-signed, expiring
+access tokens that can be verified without touching the database (and
+checked against the stored user for revocation), and the process-wide
+login rate limiter.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+# Token configuration; set COPLUR_SECRET_KEY in production so every host signs with the same key
+SECRET_KEY_FILE = os.environ.get('COPLUR_SECRET_KEY_FILE', '.coplur_secret_key')
+TOKEN_TTL = int(os.environ.get('COPLUR_TOKEN_TTL', '1800'))  # Seconds
+TOKEN_VERSION = 2  # Token format; 2 added the per-user session version claim
+SECRET_KEY_MIN_LENGTH = 32  # Shorter key files are treated as still being written
+SECRET_KEY_READ_ATTEMPTS = 20
+SECRET_KEY_RETRY_SECONDS = 0.05
+
+VALID_ROLES = ('admin', 'student')
+
+# Login throttling: token buckets per username and per client address, checked before any bcrypt work
+LOGIN_USER_BURST = int(os.environ.get('COPLUR_LOGIN_USER_BURST', '5'))
+LOGIN_USER_REFILL_SECONDS = float(os.environ.get('COPLUR_LOGIN_USER_REFILL_SECONDS', '12'))  # One attempt back per interval
+LOGIN_IP_BURST = int(os.environ.get('COPLUR_LOGIN_IP_BURST', '20'))
+LOGIN_IP_REFILL_SECONDS = float(os.environ.get('COPLUR_LOGIN_IP_REFILL_SECONDS', '3'))
+RATE_LIMIT_MAX_KEYS = int(os.environ.get('COPLUR_RATE_LIMIT_MAX_KEYS', '10000'))  # Per limiter
+LOGIN_THROTTLED_MESSAGE = "Too many login attempts. Please wait {seconds} seconds and try again."
+
+def has_required_role(user, required_role=None):
+    """
+    Check a user dict against a page or endpoint role requirement
+    None only requires a logged-in user; 'admin' and 'student' require that exact role.
+    """
+    if not user or not isinstance(user, dict):
+        return False
+    if required_role is None:
+        return True
+    return user.get('role') == required_role
+
+_secret_key = None
+_secret_key_lock = threading.Lock()
+
+def _create_key_file():
+    """
+    Write a new key to a temp file and link it into place
+    The key file only ever appears complete, and if another process links
+    its key first, ours is discarded so concurrent first starts agree.
+    """
+    directory = os.path.dirname(os.path.abspath(SECRET_KEY_FILE))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.coplur_secret_key.')  # Mode 0600
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            os.link(temp_path, SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+    finally:
+        os.unlink(temp_path)
+
+def _load_secret_key():
+    """Read the signing key from COPLUR_SECRET_KEY or the key file, creating the file on first use"""
+    key = os.environ.get('COPLUR_SECRET_KEY')
+    if key:
+        return key.encode('utf-8')
+    for _ in range(SECRET_KEY_READ_ATTEMPTS):
+        try:
+            with open(SECRET_KEY_FILE, 'rb') as f:
+                key = f.read().strip()
+        except FileNotFoundError:
+            _create_key_file()
+            continue
+        if len(key) >= SECRET_KEY_MIN_LENGTH:
+            return key
+        # Never sign with an empty or short key; an older process may still be writing it
+        time.sleep(SECRET_KEY_RETRY_SECONDS)
+    raise RuntimeError(f"Secret key file {SECRET_KEY_FILE} is empty or too short; delete it to generate a new key")
+
+def get_secret_key():
+    global _secret_key
+    with _secret_key_lock:
+        if _secret_key is None:
+            _secret_key = _load_secret_key()
+        return _secret_key
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(payload_part):
+    return hmac.new(get_secret_key(), payload_part.encode('ascii'), hashlib.sha256).digest()
+
+def issue_token(user, ttl=None):
+    """
+    Create a signed token for a user dict with 'id', 'username', 'role', 'session_version' and optional 'email'
+    Returns: (token: str, expires_at: int unix time)
+    """
+    now = int(time.time())
+    expires_at = now + (TOKEN_TTL if ttl is None else ttl)
+    claims = {
+        'v': TOKEN_VERSION,
+        'uid': user['id'],
+        'usr': user['username'],
+        'role': user['role'],
+        'sv': user.get('session_version', 0),
+        'iat': now,
+        'exp': expires_at,
+    }
+    if user.get('email'):
+        claims['eml'] = user['email']
+    payload_part = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f'{payload_part}.{_b64encode(_sign(payload_part))}', expires_at
+
+def verify_token(token):
+    """
+    Check a token's signature, version and expiry without any database access
+    Returns: claims dict if valid, None otherwise
+    """
+    if not token or not isinstance(token, str) or token.count('.') != 1:
+        return None
+    payload_part, signature_part = token.split('.')
+    try:
+        signature = _b64decode(signature_part)
+        if not hmac.compare_digest(signature, _sign(payload_part)):
+            return None
+        claims = json.loads(_b64decode(payload_part))
+    except (ValueError, UnicodeError):
+        return None
+    if not isinstance(claims, dict) or claims.get('v') != TOKEN_VERSION:
+        return None
+    if claims.get('role') not in VALID_ROLES or claims.get('exp', 0) <= time.time():
+        return None
+    if not isinstance(claims.get('sv'), int):
+        return None
+    return claims
+
+def session_is_current(claims, user):
+    """
+    Check verified claims against the user's stored record (e.g. from database.get_user_by_id)
+    False once the user is deleted, changes role, or has their sessions revoked by a
+    password change or logout.
+    """
+    return bool(user) and user['id'] == claims['uid'] and user['role'] == claims['role'] \
+        and user['session_version'] == claims['sv']
+
+def user_from_claims(claims):
+    """Build the session user dict carried by a verified token"""
+    return {
+        'id': claims['uid'], 'username': claims['usr'], 'email': claims.get('eml'),
+        'role': claims['role'], 'session_version': claims['sv'],
+    }
+
+class TokenBucketLimiter:
+    """
+    Token buckets per key, held in a bounded LRU
+    Each key costs one (tokens, updated_at) tuple; when max_keys is reached the
+    least recently seen key is dropped, so actively abused keys stay tracked.
+    """
+
+    def __init__(self, capacity, refill_seconds, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.capacity = capacity
+        self.refill_seconds = refill_seconds
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'allowed': 0, 'throttled': 0, 'evictions': 0}
+
+    def acquire(self, key):
+        """
+        Take one token for key
+        Returns: 0.0 if allowed, otherwise seconds until a token is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                tokens = self.capacity
+            else:
+                tokens = min(self.capacity, bucket[0] + (now - bucket[1]) / self.refill_seconds)
+                self._buckets.move_to_end(key)
+
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+                self._stats['allowed'] += 1
+            else:
+                wait = (1 - tokens) * self.refill_seconds
+                self._stats['throttled'] += 1
+
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self._stats['evictions'] += 1
+            return wait
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, 'tracked': len(self._buckets)}
+
+# Shared by every Streamlit session and service thread in this process
+_login_user_limiter = TokenBucketLimiter(LOGIN_USER_BURST, LOGIN_USER_REFILL_SECONDS)
+_login_ip_limiter = TokenBucketLimiter(LOGIN_IP_BURST, LOGIN_IP_REFILL_SECONDS)
+
+def check_login_rate(username, client_address=None):
+    """
+    Take a login attempt from the client address and username buckets
+    Returns: (allowed: bool, retry_after: seconds to wait when throttled)
+    """
+    checks = [('username', _login_user_limiter, str(username).strip().lower())]
+    if client_address:
+        # Address first: one client spraying many usernames shouldn't drain each of them
+        checks.insert(0, ('address', _login_ip_limiter, client_address))
+
+    for scope, limiter, key in checks:
+        wait = limiter.acquire(key)
+        if wait:
+            metrics.registry.inc('coplur_login_throttled_total', {'scope': scope})
+            return False, wait
+    return True, 0.0
+
+def login_throttled_message(retry_after):
+    return LOGIN_THROTTLED_MESSAGE.format(seconds=max(1, int(retry_after + 0.999)))
+
+def get_rate_limit_stats():
+    """Get allowed/throttled/eviction counters and tracked key counts for both login limiters"""
+    return {'username': _login_user_limiter.stats(), 'address': _login_ip_limiter.stats()}
+
+metrics.registry.describe('coplur_login_throttled_total', "Login attempts rejected by the rate limiter before authentication")
+metrics.registry.gauge(
+    'coplur_login_rate_limiter',
+    lambda: {
+        (('scope', scope), ('stat', key)): value
+        for scope, stats in get_rate_limit_stats().items()
+        for key, value in stats.items()
+    },
+    "Login rate limiter counters and tracked keys"
+)